@@ -1,43 +1,138 @@
 import os
 import re
 import json
+import threading
+from itertools import repeat
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import nltk
 import faiss
-import numpy as np
+import ann
+import catalog
+import dedup
+from embed_cache import EmbeddingCache, chunk_hash
+from compact_store import CompactStore
 from news import articles_dump
+from tracing import span
 from nltk.tokenize import sent_tokenize
 from sentence_transformers import SentenceTransformer
 
-def chunk_by_sentence(text: str, max_words: int = 150) -> list:
+def chunk_by_sentence(text: str, max_words: int = 150, overlap: int = 0) -> list:
     """
     Split the input text into chunks without exceeding the specified max word count per chunk
     Sentence boundaries are preserved to maintain semantic structure
+    overlap: number of trailing sentences repeated at the start of the next chunk
     """
     sentences = sent_tokenize(text) # Splits text into sentences using punctuation (e.g., '.', '?', '!')
-    chunks, current = [], []
+    chunks, current, counts = [], [], []
+    words = 0 # Running word count of current, no re-joining per sentence
 
     for sentence in sentences:
-        tentative = current + [sentence]
-        if len(" ".join(tentative).split()) > max_words:
+        n = len(sentence.split())
+        if words + n > max_words:
             if current:
                 chunks.append(" ".join(current))
-                current = [sentence] # Start a new chunk w/ the current sentence
+                # Start a new chunk w/ the overlap sentences that still fit, then the current sentence
+                keep = min(overlap, len(current))
+                current, counts = (current[-keep:], counts[-keep:]) if keep else ([], [])
+                words = sum(counts)
+                while current and words + n > max_words:
+                    words -= counts.pop(0)
+                    current.pop(0)
+                current.append(sentence)
+                counts.append(n)
+                words += n
         else:
             current.append(sentence)
+            counts.append(n)
+            words += n
     if current:
         chunks.append(" ".join(current))
 
     return chunks
 
-def embedding(_q):
-    try:
-        nltk.data.find('tokenizers/punkt_tab')
-    except LookupError:   
-        nltk.download('punkt_tab')
+CHUNK_POOL_MIN = 16  # Smaller batches are chunked inline, not worth the IPC
 
-    # Dump articles and return the saved file path
-    path = articles_dump(_q) 
+_chunk_pool = None  # (pool, workers)
+_chunk_pool_lock = threading.Lock()
+
+def get_chunk_pool(workers = None):
+    """
+    (pool, workers): the process-wide chunking pool, created on the first large batch and reused,
+    forking the process that holds the encoder once, not once per batch
+    """
+    global _chunk_pool
+    with _chunk_pool_lock:
+        if _chunk_pool is None:
+            workers = workers or os.cpu_count()
+            _chunk_pool = ProcessPoolExecutor(max_workers = workers), workers
+        return _chunk_pool
+
+def chunk_articles(articles: list, max_words: int = 150, overlap: int = 0, workers: int = None) -> list:
+    """
+    Chunk a batch of articles, in the shared process pool for large batches
+    workers: the pool's size if this call creates it
+    Returns one list of chunks per article, in input order
+    """
+    with span("nlp.chunk", n = len(articles), bytes = sum(len(a) for a in articles)):
+        if len(articles) < CHUNK_POOL_MIN:
+            return [chunk_by_sentence(a, max_words, overlap) for a in articles]
+        pool, workers = get_chunk_pool(workers)
+        return list(pool.map(
+            chunk_by_sentence, articles,
+            repeat(max_words), repeat(overlap),
+            chunksize = max(1, len(articles) // (workers * 4)),
+        ))
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+LOADED_MAX = 32  # Per-company (index, chunks) kept in memory
+VECTOR_STORE = os.getenv("STOCKREC_VECTOR_STORE", "faiss")  # "compact": one int8 memory-mapped store for every company
+
+_model = None
+_model_lock = threading.Lock()
+_embedding_cache = None
+_loaded = OrderedDict()  # query key -> (content hash, index, chunks, records), LRU order
+_loaded_lock = threading.Lock()
+_compact_store = None
+
+def get_model():
+    """
+    Return the process-wide SentenceTransformer, loaded once
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                try:
+                    nltk.data.find('tokenizers/punkt_tab')
+                except LookupError:   
+                    nltk.download('punkt_tab')
+                _model = SentenceTransformer(MODEL_NAME)
+    return _model
 
+def get_embedding_cache():
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _model_lock:
+            if _embedding_cache is None:
+                dim = get_model().get_sentence_embedding_dimension()
+                _embedding_cache = EmbeddingCache(MODEL_NAME, dim)
+    return _embedding_cache
+
+def get_compact_store():
+    global _compact_store
+    if _compact_store is None:
+        dim = get_model().get_sentence_embedding_dimension()
+        with _model_lock:
+            if _compact_store is None:
+                _compact_store = CompactStore(dim)
+    return _compact_store
+
+def load_chunks(path):
+    """
+    Read a JSONL dump and split every article into chunk records
+    {"hash", "text", "date", "source"}, embedding() tags them with "company"
+    """
     articles = []
     with open(path, "r", encoding = "utf-8") as f:
         for line in f:
@@ -47,47 +142,173 @@ def embedding(_q):
             article = article.strip()
             article = article.replace("\\n", "\n") # Convert escaped newlines to real line breaks
             article = re.sub(r'[ \t]+', ' ', article) # Remove spaces and tabs
-            articles.append(article)
+            articles.append((article, data.get("publish_date"), data.get("url")))
 
 
     results = []
-    for article in articles:
-        chunks = chunk_by_sentence(article)
-        results.append(chunks)
-
-    # Embedding model only accepts List[str]
-    flattened_chunks = [chunk for article_chunks in results for chunk in article_chunks]
-
-    save_dir = os.path.join(".", "vector_store")
-    os.makedirs(save_dir, exist_ok = True)
-
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    base_path = os.path.splitext(path)[0]
-    file_name = os.path.basename(base_path)
-    faiss_path = os.path.join(save_dir, f"{file_name}.faiss")
-
-    if not os.path.exists(faiss_path):
-        embeddings = model.encode(
-            flattened_chunks,
-            batch_size = 32,
-            show_progress_bar = True
-        )
-        embedding_matrix = np.array(embeddings).astype("float32")
-        if embedding_matrix.shape[0] == 0:
+    chunked = chunk_articles([article for article, _, _ in articles])
+    for (article, date, source), chunks in zip(articles, chunked):
+        for chunk in chunks:
+            results.append({"hash": chunk_hash(chunk), "text": chunk, "date": date, "source": source})
+
+    return results
+
+def embedding(_q):
+    return load_company(_q)[:3]
+
+def load_company(_q):
+    """
+    (model, index, chunk texts, chunk records) for company _q, the records
+    carry the date and source that retrieve() filters on
+    """
+    # Concurrent ingests of one company wait for each other, then reuse its result
+    with catalog.company_lock(_q), span("nlp.embedding", query = _q) as s:
+        return _embedding(_q, s)
+
+def _embedding(_q, s):
+    model = get_model()
+
+    # Dump articles and return the saved file path
+    path = articles_dump(_q) 
+
+    # Reuse the loaded index and chunks while the dump is unchanged
+    entry = catalog.lookup(_q)
+    key = catalog.normalise(_q)
+    with _loaded_lock:
+        cached = _loaded.get(key)
+        if cached is not None and entry is not None and cached[0] == entry["content_hash"]:
+            _loaded.move_to_end(key)
+            s.set(cache = "hit", n = cached[1].ntotal)
+            return model, cached[1], cached[2], cached[3]
+    s.set(cache = "miss")
+
+    # One index per company, kept across dumps and appended to; an index recorded
+    # under an older, collision-prone name is rebuilt once under the hashed one
+    faiss_path = catalog.index_path(key)
+    os.makedirs(os.path.dirname(faiss_path), exist_ok = True)
+    records_path = catalog.chunks_path(faiss_path)
+
+    # Chunks already indexed for this company, one record per index row
+    index, records = None, []
+    if os.path.exists(faiss_path) and os.path.exists(records_path):
+        index = ann.set_search_params(faiss.read_index(faiss_path))
+        with open(records_path, "r", encoding = "utf-8") as f:
+            records = [json.loads(line) for line in f]
+        if len(records) != index.ntotal:
+            print(f"Index for '{_q}' out of sync with its chunks, rebuilding")
+            index, records = None, []
+
+    # The catalog knows which dump the index was last updated from
+    if index is None or not catalog.index_is_fresh(entry):
+        rebuilt = index is None
+        known = {r["hash"] for r in records}
+        new_records = []
+        for r in load_chunks(path):
+            if r["hash"] not in known:
+                known.add(r["hash"])
+                r["company"] = key
+                new_records.append(r)
+
+        if new_records:
+            # Only chunks never embedded before reach the encoder
+            embedding_matrix = get_embedding_cache().encode(model, [r["text"] for r in new_records])
+            if index is None:
+                # Euclidean distance (smaller is better), index type picked by corpus size
+                index = ann.build_index(embedding_matrix)
+                mode = "w"
+            else:
+                index.add(embedding_matrix)
+                mode = "a"
+
+            faiss.write_index(index, faiss_path)
+            with open(records_path, mode, encoding = "utf-8") as f:
+                for r in new_records:
+                    f.write(json.dumps(r, ensure_ascii = False) + "\n")
+            records.extend(new_records)
+
+        if index is None:
             raise ValueError(f"Embedding matrix is empty for query '{_q}'. Check your data pipeline.")
-        dimension = embedding_matrix.shape[1]  # Usually 384 for MiniLM models
-        # [0]: #vec
-        # [1]: dim of the vec
-        
-        index = faiss.IndexFlatL2(dimension) # Euclidean distance (smaller is better); or use cosine similarity (larger is better) if needed
-        # < 10,000: Use a flat index (IndexFlatL2) for exact results — no need for approximate methods.
-        # 10K–1M+: Use approximate search to speed things up — like IVF or HNSW.
-        # 100M+: Consider product quantization (PQ) to save memory.
-
-        index.add(embedding_matrix)
-        faiss.write_index(index, faiss_path)
-    else:
-        # Load existing FAISS index (need better logic to decide when to regenerate)
-        index = faiss.read_index(faiss_path)
-
-    return model, index, flattened_chunks
\ No newline at end of file
+        if entry is not None:
+            catalog.record_index(_q, faiss_path, entry["content_hash"])
+
+        # The dump's articles count as ingested only now. A rebuilt index holds this
+        # dump alone, so the articles of earlier dumps are forgotten and fetched again
+        deduper = dedup.Deduper(key, dump = path)
+        if rebuilt:
+            deduper.reset(keep_pending = True)
+        deduper.commit()
+
+    flattened_chunks = [r["text"] for r in records]
+    s.set(n = index.ntotal)
+
+    if entry is not None:
+        with _loaded_lock:
+            _loaded[key] = (entry["content_hash"], index, flattened_chunks, records)
+            _loaded.move_to_end(key)
+            while len(_loaded) > LOADED_MAX:
+                _loaded.popitem(last = False)
+
+    return model, index, flattened_chunks, records
+
+def compact_embedding(_q):
+    """
+    Ingest the company's dump into the compact store when it changed,
+    nothing is loaded: the store is searched through its memory maps
+    """
+    with catalog.company_lock(_q), span("nlp.embedding", query = _q, store = "compact") as s:
+        model = get_model()
+        path = articles_dump(_q)
+        entry = catalog.lookup(_q)
+        key = catalog.normalise(_q)
+        store = get_compact_store()
+
+        content_hash = entry["content_hash"] if entry is not None else None
+        if content_hash is None or store.content_hash(key) != content_hash:
+            records = load_chunks(path)
+            if records:
+                # Chunks embedded before are embedding cache hits, the store skips those it holds
+                vectors = get_embedding_cache().encode(model, [r["text"] for r in records])
+                s.set(cache = "miss", added = store.add(key, records, vectors, content_hash))
+            dedup.Deduper(key, dump = path).commit()
+        else:
+            s.set(cache = "hit")
+
+        if not len(store.rows(key)):
+            raise ValueError(f"Embedding matrix is empty for query '{_q}'. Check your data pipeline.")
+        return model, store, key
+
+def retrieve(_q, query, k = 5, since = None, source = None):
+    """
+    Return the k chunks about company _q closest to the query
+    One query encoding plus one search when the company is already loaded
+    since: ISO date, source: URL substring, only chunks that match are returned
+    """
+    filters = {key: value for key, value in (("since", since), ("source", source)) if value is not None}
+
+    if VECTOR_STORE == "compact":
+        model, store, key = compact_embedding(_q)
+        with span("nlp.query_encode"):
+            query_vector = model.encode([query]).astype("float32")
+        with span("compact.search", k = k, filtered = bool(filters)):
+            if not filters:
+                return [store.text(row) for _, row in store.search(query_vector, k = k, company = key)[0]]
+            # Oversampled, then filtered on the stored date / source
+            found = store.search(query_vector, k = k * 8, company = key)[0]
+            records = [store.record(row) for _, row in found]
+        return [r["text"] for r in records if ann.matches(r, **filters)][:k]
+
+    model, index, flattened_chunks, records = load_company(_q)
+
+    # Encode the query into a vector
+    with span("nlp.query_encode"):
+        query_vector = model.encode([query]).astype("float32")
+
+    if filters:
+        # Widens the search until k chunks pass the filters
+        return [r["text"] for _, r in ann.search(index, records, query_vector, k = k, **filters)[0]]
+
+    # Perform vector search to retrieve the top k most similar chunks
+    with span("faiss.search", k = k, ntotal = index.ntotal):
+        D, I = index.search(query_vector, k = k)
+
+    return [flattened_chunks[idx] for idx in I[0] if idx != -1]
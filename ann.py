@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import faiss
+import numpy as np
+import catalog
+from tracing import span
+
+# Approximate nearest neighbour index factory.
+# < 10,000: Use a flat index (IndexFlatL2) for exact results — no need for approximate methods.
+# 10K–1M+: Use approximate search to speed things up — like IVF or HNSW.
+# 100M+: Consider product quantization (PQ) to save memory.
+FLAT_MAX = 10_000
+HNSW_MAX = 1_000_000
+IVF_FLAT_MAX = 10_000_000
+
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+NPROBE = 16
+TRAIN_PER_LIST = 64  # Training vectors sampled per IVF list
+
+SAVE_DIR = os.path.join(".", "vector_store")
+GLOBAL_INDEX = os.path.join(SAVE_DIR, "_global.faiss")
+GLOBAL_META = os.path.join(SAVE_DIR, "_global.meta.jsonl")
+
+
+def choose_kind(n):
+    '''
+    Pick the index type by corpus size
+    '''
+    if n < FLAT_MAX:
+        return "flat"
+    if n < HNSW_MAX:
+        return "hnsw"
+    if n < IVF_FLAT_MAX:
+        return "ivf_flat"
+    return "ivf_pq"
+
+
+def index_spec(kind, n, dim):
+    # faiss.index_factory description string for each kind
+    nlist = max(1, int(4 * np.sqrt(n)))
+    if kind == "flat":
+        return "Flat"
+    if kind == "hnsw":
+        return f"HNSW{HNSW_M}"
+    if kind == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if kind == "ivf_pq":
+        return f"IVF{nlist},PQ{dim // 8}"  # 8 dims per 1-byte sub-quantizer
+    raise ValueError(f"Unknown index kind '{kind}'")
+
+
+def train_min(kind, n):
+    # IVF needs a vector per list, PQ one per code of its 256-entry sub-quantizers
+    nlist = max(1, int(4 * np.sqrt(n)))
+    return {"ivf_flat": nlist, "ivf_pq": max(nlist, 256)}.get(kind, 0)
+
+
+def build_index(matrix, kind = None):
+    '''
+    Build and fill an L2 index over matrix (n, dim) float32
+    kind: flat / hnsw / ivf_flat / ivf_pq, default by corpus size; IVF / PQ fall back to flat
+    when n is below their training minimum
+    '''
+    matrix = np.ascontiguousarray(matrix, dtype = "float32")
+    n, dim = matrix.shape
+    kind = kind or choose_kind(n)
+    if n < train_min(kind, n):
+        print(f"{n} vectors are too few to train {kind}, using flat")
+        kind = "flat"
+    index = faiss.index_factory(dim, index_spec(kind, n, dim), faiss.METRIC_L2)
+
+    if not index.is_trained:
+        nlist = faiss.extract_index_ivf(index).nlist
+        sample = matrix
+        if n > nlist * TRAIN_PER_LIST:
+            sample = matrix[np.random.default_rng(0).choice(n, nlist * TRAIN_PER_LIST, replace = False)]
+        index.train(sample)
+
+    index.add(matrix)
+    set_search_params(index)
+    return index
+
+
+def set_search_params(index):
+    # Search-time knobs are not serialised, set them again after read_index
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    try:
+        faiss.extract_index_ivf(index).nprobe = NPROBE
+    except RuntimeError:
+        pass  # Not an IVF index
+    return index
+
+
+def matches(record, company = None, since = None, source = None):
+    return (
+        (company is None or record.get("company") == catalog.normalise(company))
+        and (since is None or (record.get("date") or "") >= since)
+        and (source is None or source in (record.get("source") or ""))
+    )
+
+
+def search(index, records, query_vectors, k = 5, **filters):
+    '''
+    Top-k records per query that pass the metadata filters
+    (company, since: ISO date, source: URL substring)
+    Oversamples and widens the search until k matches are found
+    '''
+    results = []
+    with span("faiss.search", k = k, ntotal = index.ntotal, filtered = bool(filters)):
+        for q in np.ascontiguousarray(query_vectors, dtype = "float32").reshape(-1, index.d):
+            fetch = k if not filters else k * 8
+            while True:
+                D, I = index.search(q[None, :], min(fetch, index.ntotal))
+                hits = [(float(d), records[i]) for d, i in zip(D[0], I[0]) if i != -1 and matches(records[i], **filters)]
+                if len(hits) >= k or fetch >= index.ntotal:
+                    break
+                fetch *= 4
+            results.append(hits[:k])
+    return results
+
+
+def load_company_records(save_dir = SAVE_DIR):
+    '''
+    Every per-company chunk record, tagged with its company key
+    '''
+    records = []
+    for fname in sorted(os.listdir(save_dir)):
+        if not fname.endswith(".chunks.jsonl") or fname.startswith("_"):
+            continue
+        company = fname[:-len(".chunks.jsonl")]
+        with open(os.path.join(save_dir, fname), "r", encoding = "utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                record.setdefault("company", company)
+                records.append(record)
+    return records
+
+
+def cached_vectors(records):
+    '''
+    (records that have a cached embedding, their vectors as a float32 matrix)
+    '''
+    from NLP import get_embedding_cache
+
+    cache = get_embedding_cache()
+    rows = cache.lookup([r["hash"] for r in records])
+    records = [r for r in records if r["hash"] in rows]
+    return records, np.array(cache.matrix()[[rows[r["hash"]] for r in records]], dtype = "float32")
+
+
+def build_global_index(kind = None, save_dir = SAVE_DIR):
+    '''
+    One cross-company index over every chunk, vectors come from the embedding cache
+    '''
+    records = load_company_records(save_dir)
+    if not records:
+        raise ValueError("No company chunks to index, run a search first")
+    records, matrix = cached_vectors(records)
+
+    start = time.perf_counter()
+    # $STOCKREC_INDEX applies here only, per-company indexes stay sized by their own corpus
+    index = build_index(matrix, kind or os.getenv("STOCKREC_INDEX"))
+    print(f"Built {type(index).__name__} over {index.ntotal} chunks in {time.perf_counter() - start:.1f}s")
+
+    faiss.write_index(index, GLOBAL_INDEX)
+    with open(GLOBAL_META, "w", encoding = "utf-8") as f:
+        for r in records:
+            f.write(json.dumps({k: r.get(k) for k in ("hash", "company", "date", "source")}, ensure_ascii = False) + "\n")
+    return index, records
+
+
+def load_global_index():
+    index = set_search_params(faiss.read_index(GLOBAL_INDEX))
+    with open(GLOBAL_META, "r", encoding = "utf-8") as f:
+        records = [json.loads(line) for line in f]
+    return index, records
+
+
+def evaluate(matrix, queries, kinds = ("flat", "hnsw", "ivf_flat", "ivf_pq"), k = 10):
+    '''
+    Build time, memory, search latency and recall@k against Flat for each kind
+    '''
+    queries = np.ascontiguousarray(queries, dtype = "float32")
+    exact = build_index(matrix, "flat")
+    _, truth = exact.search(queries, k)
+
+    report = []
+    for kind in kinds:
+        if len(matrix) < train_min(kind, len(matrix)):
+            report.append({"kind": kind, "error": f"needs at least {train_min(kind, len(matrix))} vectors to train"})
+            continue
+        start = time.perf_counter()
+        try:
+            index = build_index(matrix, kind)
+        except RuntimeError as e:
+            # e.g. too few vectors to train IVF / PQ centroids
+            report.append({"kind": kind, "error": str(e).splitlines()[0]})
+            continue
+        build_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        search_s = time.perf_counter() - start
+
+        recall = np.mean([len(set(t) & set(f)) / k for t, f in zip(truth, found)])
+        report.append({
+            "kind": kind,
+            "n": int(index.ntotal),
+            "build_s": round(build_s, 3),
+            "memory_bytes": int(faiss.serialize_index(index).nbytes),
+            "search_ms_per_query": round(1000 * search_s / len(queries), 4),
+            f"recall@{k}": round(float(recall), 4),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    # python ann.py build [kind]  |  python ann.py report [n_queries]
+    if len(sys.argv) > 1 and sys.argv[1] == "report":
+        _, matrix = cached_vectors(load_company_records())
+        n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        queries = matrix[np.random.default_rng(1).choice(len(matrix), min(n_queries, len(matrix)), replace = False)]
+        for row in evaluate(matrix, queries):
+            print(json.dumps(row))
+    else:
+        build_global_index(sys.argv[2] if len(sys.argv) > 2 else None)
@@ -3,21 +3,35 @@ import altair as alt
 import yfinance as yf
 import numpy as np
 import random
-import re
 import pandas as pd
+import json
+import queue
+import pipeline
+import tracing
+import service_client
 from linear_regression_model import linRegVis, get_selectors_chart, get_points_chart
-from llmAPI import get_response
-from score import capm, wacc, capm_wacc_score, get_financial_scores, get_final_score
+from search_index import SymbolIndex
+from symbol_list import load_symbols
+from score import capm, wacc, capm_wacc_score, get_financial_scores, get_final_score, get_decision, parse_score
+
+if service_client.ENABLED:
+    # Thin client: history, scores, retrieval and the LLM come from service.py,
+    # the encoder and indexes are not loaded in this process
+    from service_client import get_history, stream_response
+else:
+    from prices import get_history
+    from llmAPI import OUTLOOK_QUERY, stream_response
 
 st.title("Stock Investment Recommendation")
 
 main, chat = st.columns([3, 2])
 
 with main:
-    @st.cache_data
-    def load_symbols():
-        return pd.read_csv('src/symbol.csv')
-    df = load_symbols()
+    @st.cache_resource
+    def load_symbol_index():
+        # Built once per process, shared by every session
+        return SymbolIndex(load_symbols())
+    symbol_index = load_symbol_index()
 
     with st.form("search"):
         query = st.text_input(
@@ -26,19 +40,11 @@ with main:
             placeholder="e.g., AAPL, TSLA, etc."
         )
 
-        if query:
-            filtered = df[
-                df['Symbol'].str.contains(query, case=False, na=False) |
-                df['Name'].str.contains(query, case=False, na=False)
-            ]
-        else:
-            filtered = df
-
-        stocks = filtered["Symbol"] + " - " + filtered["Name"]
+        stocks = symbol_index.search(query or "")
 
         choice = st.selectbox(
             "Choose a stock from filtered results:",
-            options=stocks if not stocks.empty else ["No match found"]
+            options=stocks if stocks else ["No match found"]
         )
 
         chaos = st.slider(
@@ -57,21 +63,14 @@ with main:
 
 
 
-    def clean_company_name(name):
-        # Split at the first occurrence of any of the keywords and keep only the part before
-        parts = re.split(
-            r'\b(Inc\.?|Incorporated|Ltd\.?|Limited|Corp\.?|Corporation|LLC|PLC|S\.A\.|AG|N\.V\.|Co\.?|Common [A-Z]* Stock|Class [A-Z]|Ordinary Shares)\b\.?',
-            name, flags=re.IGNORECASE, maxsplit=1
-        )
-        return parts[0].strip(" ,")
     # Visualisation
     if choice != "No match found":
-        symbol = choice.split(" - ")[0].strip()
-        name = choice.split(" - ", 1)[1].strip()
-        name = clean_company_name(name)
+        # Company name already cleaned when the index was built
+        symbol, name = symbol_index.resolve(choice)
 
     dat = yf.Ticker(symbol)
-    hist = dat.history(period='5d', interval='1h').reset_index()
+    # Served from the local OHLCV store, only new bars are downloaded
+    hist = get_history(symbol, period='5d', interval='1h').reset_index()
     hist['Datetime'] = pd.to_datetime(hist['Datetime'])  # Ensure correct dtype
 
 
@@ -129,53 +128,103 @@ with main:
 
 
 
-    @st.cache_data(ttl="1d")
-    def cached_capm_wacc_score(capm, wacc):
-        return capm_wacc_score(capm, wacc)
-
-    @st.cache_data(ttl="1d")
-    def cached_get_financial_scores(symbol):
-        return get_financial_scores(symbol)
-
-
-    if submit:
-        capm = capm(dat)
-        wacc = wacc(dat, capm)
-        capm_wacc_score = cached_capm_wacc_score(capm, wacc)
-        financial_scores = cached_get_financial_scores(symbol)
-        financial_scores.update({
-            "capm_wacc": capm_wacc_score
-        })
+    def fin_and_final(capm_wacc, multiples, news):
+        financial_scores = dict(multiples, capm_wacc=capm_wacc)
         fin_score = 0.25 * sum(financial_scores.values())
-
-        st.subheader(f"CAPM: {capm:.4f}")
-        st.subheader(f"WACC: {wacc:.4f}")
-        st.subheader(f"EV/EBITDA: {financial_scores['ev_ebitda']:.4f}")
-        st.subheader(f"P/E: {financial_scores['pe_ratio']:.4f}")
-        st.subheader(f"P/B: {financial_scores['pb_ratio']:.4f}")
-
-        slope = model.coef_[0]
-        index_score = np.tanh(slope / 2)
-
-
-        initial_msg = get_response(_q=name, query=f"What are the latest news and outlook for {name}?")
-        print(initial_msg)
-        match = re.search(r'\*{0,2}score\*{0,2}\s*:\s*([-+]?\d*\.?\d+)', initial_msg, re.IGNORECASE)        
-        news_score = float(match.group(1))
         subscores = {
             "fin": fin_score,
-            "news": news_score,
+            "news": news[1],
             "index": index_score,
             "random": random_score
         }
         final_score = get_final_score(subscores)
-        if final_score > 0.3:
-            decision = "BUY"
-        elif final_score < -0.3:
-            decision = "SELL"
+        return final_score, get_decision(final_score)
+
+
+    if submit:
+        slope = model.coef_[0]
+        index_score = np.tanh(slope / 2)
+
+        # Independent stages run in parallel, each result is shown as soon as it is ready
+        slots = {key: st.empty() for key in ("capm", "wacc", "ev_ebitda", "pe_ratio", "pb_ratio", "news", "answer", "final")}
+        for key, label in [("capm", "CAPM"), ("wacc", "WACC"), ("ev_ebitda", "EV/EBITDA"),
+                           ("pe_ratio", "P/E"), ("pb_ratio", "P/B"), ("news", "News Score"), ("final", "Final Score")]:
+            slots[key].caption(f"{label}: loading...")
+
+        # The answer streams in from the news stage's thread (or the service), rendered here between stage completions
+        news_deltas = queue.Queue()
+        news_parts = []
+
+        def show_news():
+            while not news_deltas.empty():
+                news_parts.append(news_deltas.get_nowait())
+            text = "".join(news_parts)
+            if text:
+                slots["answer"].markdown(text)
+                # The score is shown as soon as its line is complete, not at the end of the answer
+                news_score = parse_score(text, complete=False)
+                if news_score is not None:
+                    slots["news"].subheader(f"News Score: {news_score}")
+
+        if service_client.ENABLED:
+            # Computed once per ticker in the service, shared with every other session
+            events = service_client.recommend(symbol, name, random_score, deltas=news_deltas)
         else:
-            decision = "HOLD"
-        st.subheader(f"Final Score: {final_score:.2f}, Decision: {decision}")
+            def stream_news():
+                parts = []
+                for delta in stream_response(_q=name, query=f"{OUTLOOK_QUERY} {name}?"):
+                    parts.append(delta)
+                    news_deltas.put(delta)
+                text = "".join(parts)
+                return text, parse_score(text)
+
+            stages = {
+                "capm": (lambda: capm(dat), []),
+                "wacc": (lambda capm: wacc(dat, capm), ["capm"]),
+                "capm_wacc": (lambda capm, wacc: capm_wacc_score(capm, wacc), ["capm", "wacc"]),
+                # Sector multiples come from the on-disk store, refreshed at most once a day
+                "multiples": (lambda: get_financial_scores(symbol), []),
+                # Cached with its parsed score while the retrieved news is unchanged
+                "news": (stream_news, []),
+                "final": (fin_and_final, ["capm_wacc", "multiples", "news"]),
+            }
+            events = pipeline.run(stages, poll=0.05)
+
+        # One trace per recommendation, shown below the results when STOCKREC_TRACE is set
+        with tracing.trace("recommendation", symbol=symbol) as request_trace:
+            for stage, result, error in events:
+                if stage is None:
+                    show_news()
+                    continue
+                if error is not None:
+                    # A failed stage is reported in its own slot, or in its dependents' (capm_wacc -> final)
+                    keys = ["ev_ebitda", "pe_ratio", "pb_ratio"] if stage == "multiples" else [stage]
+                    for key in keys:
+                        if key in slots:
+                            slots[key].error(f"{stage} failed: {error}")
+                    continue
+                if stage == "capm":
+                    slots["capm"].subheader(f"CAPM: {result:.4f}")
+                elif stage == "wacc":
+                    slots["wacc"].subheader(f"WACC: {result:.4f}")
+                elif stage == "multiples":
+                    slots["ev_ebitda"].subheader(f"EV/EBITDA: {result['ev_ebitda']:.4f}")
+                    slots["pe_ratio"].subheader(f"P/E: {result['pe_ratio']:.4f}")
+                    slots["pb_ratio"].subheader(f"P/B: {result['pb_ratio']:.4f}")
+                elif stage == "news":
+                    initial_msg, news_score = result
+                    print(initial_msg)
+                    slots["answer"].markdown(initial_msg)
+                    slots["news"].subheader(f"News Score: {news_score}")
+                elif stage == "final":
+                    final_score, decision = result
+                    slots["final"].subheader(f"Final Score: {final_score:.2f}, Decision: {decision}")
+
+        if tracing.ENABLED:
+            with st.expander("Timing breakdown"):
+                st.dataframe(pd.DataFrame(request_trace.summary()), hide_index=True)
+                st.download_button("Download trace (OpenTelemetry JSON)", json.dumps(request_trace.to_otel()),
+                                   file_name=f"trace_{symbol}.json", mime="application/json")
 
 
 
@@ -198,7 +247,9 @@ with chat:
     prompt = st.chat_input("Ask some questions")
     if prompt:
         st.session_state["chat_history"].append({"role": "user", "content": prompt})
-        response = get_response(_q=name, query=prompt)
+        messages.chat_message("user").write(prompt)
+        # Rendered token by token, the full answer is kept in the history
+        response = messages.chat_message("assistant").write_stream(stream_response(_q=name, query=prompt))
         st.session_state["chat_history"].append({"role": "assistant", "content": response})
 
 
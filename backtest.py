@@ -0,0 +1,282 @@
+import os
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import sector_store
+from prices import get_panel
+from linear_regression_model import rolling_slopes
+from score import BASE_WEIGHTS, BUY_THRESHOLD, SELL_THRESHOLD, SNP500_PATH, capm_wacc_score, get_weights
+
+# Vectorized backtest of the scoring formula over the local OHLCV store.
+# Every (ticker, trading day) is scored as array operations, at the day's last bar:
+# - index: tanh(slope / 2) of the app's log-price trend over the trailing `window_days`
+# - fin: sector-relative EV/EBITDA, P/E and P/B from today's multiples, CAPM-WACC from
+#   the screener output when there is one, else 0. No point-in-time fundamentals are
+#   stored, so fin is held at today's values on every past day. --price-scaled rescales
+#   the multiples by price(t) / price(today) (earnings and book held at their last values)
+# - news and chaos: 0, there is no history for them
+# Weights follow the previous day's ^VIX close as in score.get_weights; the decisions use
+# get_decision's thresholds. A decision is judged on the return `horizon_days` later.
+# This is not a point-in-time backtest:
+# - look-ahead: today's multiples and screener CAPM-WACC are applied to every past date
+#   (by default too), --price-scaled also leaks each ticker's later return into its
+#   earlier score. --no-fin leaves fin out (0), only the trend subscore is then tested
+# - survivorship: the universe is today's S&P 500, names dropped from it are missing
+# Read the results as an upper bound, not as the formula's expected performance.
+#   python backtest.py [--limit N] [--interval 1d] [--period 10y] [--no-fin] [--sweep] [--workers N]
+OUTPUT_PATH = os.path.join(".", "backtest.parquet")
+SCREENER_PATH = os.path.join(".", "screener.parquet")  # screener.py's ranked output
+DEFAULT_PERIOD = {"1h": "730d", "1d": "10y"}  # 1h bars only reach back 730 days
+WORKERS = os.cpu_count()
+SURVIVORSHIP_WARNING = "The universe is today's S&P 500 (survivorship bias), treat the results as an upper bound"
+LOOKAHEAD_WARNING = "fin applies today's multiples to every past date (look-ahead bias), --no-fin leaves it out"
+
+DEFAULT_PARAMS = {
+    "fin": BASE_WEIGHTS["fin"],
+    "news": BASE_WEIGHTS["news"],
+    "index": BASE_WEIGHTS["index"],
+    "buy": BUY_THRESHOLD,
+    "sell": SELL_THRESHOLD,
+    "window_days": 5,   # The app fits 5 days of bars
+    "horizon_days": 5,  # And predicts 5 days ahead
+}
+
+SWEEP_GRID = {
+    "fin": [0.25, 0.45, 0.65],
+    "index": [0.1, 0.2, 0.4],
+    "buy": [0.1, 0.2, 0.3, 0.4],
+    "sell": [-0.1, -0.2, -0.3, -0.4],
+    "window_days": [3, 5, 10],
+}
+
+
+def _day_ends(times):
+    '''
+    Position of each New York trading day's last bar, and that day
+    '''
+    days = pd.DatetimeIndex(times).tz_convert("America/New_York").normalize()
+    last = np.flatnonzero(np.append(days[1:] != days[:-1], True))
+    return last, days[last]
+
+
+def financial_scores(sectors_df, closes, day_prices, price_scaled = False,
+                     path = sector_store.DB_PATH, screener_path = SCREENER_PATH):
+    '''
+    (tickers, days) fin subscore: 0.25 * (EV/EBITDA + P/E + P/B + CAPM-WACC scores)
+    closes: the panel's last close per ticker, day_prices: (tickers, days) closes
+    '''
+    multiples = sector_store.load_multiples(path)
+    members = sectors_df.drop_duplicates("Symbol").set_index("Symbol")["GICS Sector"]
+    multiples = multiples[multiples.index.isin(members.index)]
+    universe = multiples.index.union(day_prices.index)
+
+    # Price relative to today; peers without bars keep today's multiples
+    if price_scaled:
+        ratio = day_prices.ffill(axis = 1).div(closes, axis = 0).reindex(universe).fillna(1.0).values
+    else:
+        ratio = np.ones((len(universe), day_prices.shape[1]))
+    sector = members.reindex(universe).fillna("Unknown")
+    codes, names = pd.factorize(sector)
+    peers = sector.map(members.value_counts()).fillna(1).values - 1
+
+    scores = []
+    for field in sector_store.FIELDS:
+        own = multiples[field].reindex(universe).values[:, None] * ratio
+        totals = np.zeros((len(names), own.shape[1]))
+        np.add.at(totals, codes, np.nan_to_num(own))
+        # Same average as get_multiples: the peers' sum over the number of peers
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            avg = (totals[codes] - own) / np.where(peers > 0, peers, 1)[:, None]
+            scores.append(avg / own)
+
+    capm_wacc = pd.Series(0.0, index = universe)
+    if screener_path and os.path.exists(screener_path):
+        screened = pd.read_parquet(screener_path)
+        if "capm" in screened and "wacc" in screened:
+            screened = screened.dropna(subset = ["capm", "wacc"]).set_index("symbol")
+            values = [capm_wacc_score(c, w) for c, w in zip(screened["capm"], screened["wacc"])]
+            capm_wacc.update(pd.Series(values, index = screened.index))
+
+    fin = 0.25 * (sum(scores) + capm_wacc.values[:, None])
+    return pd.DataFrame(fin, index = universe, columns = day_prices.columns).reindex(day_prices.index).values
+
+
+def load_data(symbols, period = None, interval = "1d", price_scaled = False, sectors_path = SNP500_PATH, fin = True):
+    '''
+    Everything the simulation needs as arrays, computed once
+    fin = False: fin subscore 0, free of the look-ahead in today's multiples
+    '''
+    period = period or DEFAULT_PERIOD.get(interval, "10y")
+    panel = get_panel(symbols, period = period, interval = interval)
+    panel = panel.dropna(how = "all")
+    times = panel.columns
+    hours = (times - times[0]).total_seconds().values / 3600.0
+    ends, days = _day_ends(times)
+    bars_per_day = max(1, int(round(np.median(np.diff(np.append(-1, ends))))))
+
+    # Previous trading day's close, so a decision never sees the VIX of its own session
+    vix = get_panel(["^VIX"], period = period, interval = "1d")
+    if vix.empty:
+        vix_days = np.full(len(days), 20.0)
+        print("No ^VIX history, using 20")
+    else:
+        vix = vix.iloc[0].dropna()
+        vix.index = vix.index.tz_convert("America/New_York").normalize()
+        vix_days = vix.shift(1).reindex(days, method = "ffill").fillna(20.0).values
+
+    day_prices = pd.DataFrame(panel.values[:, ends], index = panel.index, columns = days)
+    if fin:
+        sectors_df = pd.read_csv(sectors_path)
+        sector_store.refresh(sectors_df)
+        closes = panel.ffill(axis = 1).iloc[:, -1]
+        fin_scores = financial_scores(sectors_df, closes, day_prices, price_scaled)
+    else:
+        # No multiples are refreshed or loaded when the term is left out
+        fin_scores = np.zeros(day_prices.shape)
+
+    return {
+        "symbols": panel.index.tolist(),
+        "days": days,
+        "log_prices": np.log(panel.values),
+        "hours": hours,
+        "ends": ends,
+        "bars_per_day": bars_per_day,
+        "day_prices": day_prices.values,
+        "vix": vix_days,
+        "fin": fin_scores,
+    }
+
+
+def index_scores(data, window_days):
+    '''
+    (tickers, days) index subscore from the rolling trend fit, as in the app
+    '''
+    window = window_days * data["bars_per_day"]
+    slopes = rolling_slopes(data["hours"], data["log_prices"], window, min_points = max(2, window // 2))
+    return np.tanh(slopes[:, data["ends"]] / 2)
+
+
+def simulate(data, params = None, index = None):
+    '''
+    Decisions for every (ticker, day) and how they did
+    Returns a flat dict of parameters and metrics
+    '''
+    p = dict(DEFAULT_PARAMS, **(params or {}))
+    if index is None:
+        index = index_scores(data, p["window_days"])
+    base = {"fin": p["fin"], "news": p["news"], "index": p["index"]}
+    weights = [get_weights(v, base) for v in data["vix"]]
+    w = {key: np.array([wt[key] for wt in weights]) for key in ("fin", "index")}
+    # news and chaos subscores are 0, their weights only dilute the others
+    final = w["fin"] * data["fin"] + w["index"] * index
+
+    h = p["horizon_days"]
+    prices = data["day_prices"]
+    forward = np.full(prices.shape, np.nan)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        forward[:, :-h] = prices[:, h:] / prices[:, :-h] - 1
+
+    valid = ~np.isnan(final) & ~np.isnan(forward)
+    decision = np.where(final > p["buy"], 1, np.where(final < p["sell"], -1, 0))
+    decision[~valid] = 0
+    signed = decision * np.nan_to_num(forward)
+    buys, sells = decision == 1, decision == -1
+    trades = buys | sells
+
+    # Equal-weight book of the day's BUY / SELL calls, rebalanced every horizon (non-overlapping)
+    rebalance = np.arange(0, prices.shape[1] - h, h)
+    with np.errstate(invalid = "ignore"):
+        book = np.array([signed[trades[:, t], t].mean() if trades[:, t].any() else 0.0 for t in rebalance])
+        market = np.array([np.nanmean(forward[valid[:, t], t]) if valid[:, t].any() else 0.0 for t in rebalance])
+    periods_per_year = 252 / h
+
+    def ratio(a, b):
+        return float(a) / float(b) if b else np.nan
+
+    return {
+        **p,
+        "observations": int(valid.sum()),
+        "buys": int(buys.sum()),
+        "sells": int(sells.sum()),
+        "holds": int(valid.sum() - trades.sum()),
+        "hit_rate": ratio((signed[trades] > 0).sum(), trades.sum()),
+        "hit_rate_buy": ratio((forward[buys] > 0).sum(), buys.sum()),
+        "hit_rate_sell": ratio((forward[sells] < 0).sum(), sells.sum()),
+        "mean_trade_return": ratio(signed[trades].sum(), trades.sum()),
+        "mean_buy_return": ratio(forward[buys].sum(), buys.sum()),
+        "mean_sell_return": ratio(-forward[sells].sum(), sells.sum()),
+        "total_return": float(np.prod(1 + book) - 1) if len(book) else np.nan,
+        "sharpe": float(book.mean() / book.std() * np.sqrt(periods_per_year)) if len(book) and book.std() > 0 else np.nan,
+        "market_return": float(np.prod(1 + market) - 1) if len(market) else np.nan,
+    }
+
+
+_data = None
+_index_cache = {}
+
+
+def _init_worker(data):
+    global _data
+    _data = data
+
+
+def _simulate_worker(params):
+    # Index scores depend only on the window, computed once per worker and window
+    window = params.get("window_days", DEFAULT_PARAMS["window_days"])
+    if window not in _index_cache:
+        _index_cache[window] = index_scores(_data, window)
+    return simulate(_data, params, _index_cache[window])
+
+
+def sweep(data, grid = SWEEP_GRID, workers = WORKERS):
+    '''
+    Every combination of the grid, spread over worker processes,
+    ranked by Sharpe ratio
+    '''
+    keys = list(grid)
+    combos = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    print(f"Sweeping {len(combos)} parameter sets on {workers} workers")
+    # Grouped by window, so each worker reuses its index scores
+    combos.sort(key = lambda c: c.get("window_days", 0))
+    with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (data,)) as pool:
+        rows = list(pool.map(_simulate_worker, combos, chunksize = max(1, len(combos) // (workers * 4))))
+    return pd.DataFrame(rows).sort_values("sharpe", ascending = False, ignore_index = True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Backtest the scoring formula over cached price history")
+    parser.add_argument("--symbols", nargs = "*", help = "Default: the S&P 500 members")
+    parser.add_argument("--limit", type = int)
+    parser.add_argument("--interval", default = "1d", choices = ["1d", "1h"])
+    parser.add_argument("--period")
+    parser.add_argument("--price-scaled", action = "store_true",
+                        help = "Move the multiples with the price (look-ahead, see above)")
+    parser.add_argument("--no-fin", action = "store_true",
+                        help = "Leave the fin subscore out (0), it has no point-in-time history")
+    parser.add_argument("--sweep", action = "store_true", help = "Grid search weights, thresholds and windows")
+    parser.add_argument("--workers", type = int, default = WORKERS)
+    parser.add_argument("--output", default = OUTPUT_PATH)
+    args = parser.parse_args()
+
+    symbols = args.symbols or pd.read_csv(SNP500_PATH)["Symbol"].tolist()
+    if args.limit:
+        symbols = symbols[:args.limit]
+
+    if args.no_fin and args.price_scaled:
+        parser.error("--price-scaled has no effect with --no-fin")
+    data = load_data(symbols, args.period, args.interval, args.price_scaled, fin = not args.no_fin)
+    print(f"{len(data['symbols'])} tickers x {len(data['days'])} days")
+    print(SURVIVORSHIP_WARNING)
+    if not args.no_fin:
+        print(LOOKAHEAD_WARNING)
+    report = simulate(data)
+    for key, value in report.items():
+        print(f"{key:20s} {value}")
+
+    if args.sweep:
+        results = sweep(data, workers = args.workers)
+        print(results.head(10).to_string())
+        results.to_parquet(args.output, index = False)
+        print(f"Wrote {len(results)} parameter sets to {args.output}")
@@ -0,0 +1,549 @@
+import io
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import statistics
+import multiprocessing
+from types import SimpleNamespace
+from datetime import datetime, timezone
+from contextlib import contextmanager, ExitStack, redirect_stdout
+from unittest import mock
+import numpy as np
+import pandas as pd
+import yfinance as yf
+import NLP
+import news
+import fetch
+import market
+import prices
+import llmAPI
+import pipeline
+import screener
+import score
+from prices import get_history
+from symbol_list import load_symbols
+from search_index import clean_company_name
+from linear_regression_model import linRegVis
+from score import capm, wacc, capm_wacc_score, get_financial_scores, get_final_score, get_decision
+
+# Offline benchmarks for the whole pipeline on a plain CPU box.
+# yfinance (Ticker.info, financials, price history, bulk downloads), NewsAPI,
+# Investopedia and the market reference are replayed from fixtures. The LLM is a
+# fake that answers instantly, so the timings only cover local work.
+# Record real fixtures once (needs network and API keys):
+#   python benchmark.py record AAPL MSFT NVDA
+# Without recordings, a synthetic set is generated from a fixed seed.
+#   python benchmark.py run [--only embedding] [--output results.json]
+#   python benchmark.py baseline   # Store this machine's timings as the baseline
+# run exits with 1 when a median is over baseline * (1 + tolerance) or over
+# its max_ms in bench/thresholds.json.
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(REPO_DIR, "bench")
+FIXTURE_DIR = os.path.join(BENCH_DIR, "fixtures")
+THRESHOLDS_PATH = os.path.join(BENCH_DIR, "thresholds.json")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_PATH = os.path.join(BENCH_DIR, "results.json")
+
+SEED = 7
+SYNTHETIC_SYMBOLS = 12   # Symbols with history and articles, the batch benchmark scores all of them
+SYNTHETIC_ARTICLES = 24  # Articles per company
+
+
+class Fixtures:
+    '''
+    Recorded (or synthetic) inputs, laid out as
+        manifest.json     {"kind", "market", "symbols": {symbol: company}, "articles": {company: [{"url", "file"}]}}
+        infos.json        {symbol: Ticker.info}, every S&P 500 member (the sector averages need them)
+        financials.json   {symbol: Ticker.financials as split-oriented JSON}
+        history/<symbol>.parquet   1h OHLCV bars
+        html/<sha1(url)>.html
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "manifest.json"), "r", encoding = "utf-8") as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, "infos.json"), "r", encoding = "utf-8") as f:
+            self.infos = json.load(f)
+        with open(os.path.join(path, "financials.json"), "r", encoding = "utf-8") as f:
+            self.financials = json.load(f)
+        self.kind = self.manifest["kind"]
+        self.market = self.manifest["market"]
+        self.symbols = list(self.manifest["symbols"])
+        self._files = {a["url"]: a["file"] for articles in self.manifest["articles"].values() for a in articles}
+        self._history = {}
+
+    def company(self, symbol):
+        return self.manifest["symbols"][symbol]
+
+    def urls(self, company):
+        return [a["url"] for a in self.manifest["articles"].get(company, [])]
+
+    def html(self, url):
+        with open(os.path.join(self.path, self._files[url]), "r", encoding = "utf-8") as f:
+            return f.read()
+
+    def history(self, symbol):
+        if symbol not in self._history:
+            path = os.path.join(self.path, "history", f"{symbol}.parquet")
+            if not os.path.exists(path):
+                raise KeyError(f"No recorded history for {symbol}")
+            self._history[symbol] = pd.read_parquet(path)
+        return self._history[symbol]
+
+
+def write_fixtures(path, kind, market_ref, companies, infos, financials, histories, articles):
+    '''
+    articles: {company: [(url, html)]}
+    '''
+    os.makedirs(os.path.join(path, "history"), exist_ok = True)
+    os.makedirs(os.path.join(path, "html"), exist_ok = True)
+    manifest = {"kind": kind, "market": market_ref, "symbols": companies, "articles": {}}
+    for company, pages in articles.items():
+        manifest["articles"][company] = []
+        for url, html in pages:
+            name = os.path.join("html", hashlib.sha1(url.encode("utf-8")).hexdigest() + ".html")
+            with open(os.path.join(path, name), "w", encoding = "utf-8") as f:
+                f.write(html)
+            manifest["articles"][company].append({"url": url, "file": name})
+    for symbol, df in histories.items():
+        df[[c for c in prices.COLUMNS if c in df.columns]].to_parquet(os.path.join(path, "history", f"{symbol}.parquet"))
+    for name, data in [("manifest.json", manifest), ("infos.json", infos), ("financials.json", financials)]:
+        with open(os.path.join(path, name), "w", encoding = "utf-8") as f:
+            json.dump(data, f, default = str)
+    return path
+
+
+def _companies(symbols):
+    # Same company names the app and the screener query the news with
+    names = load_symbols().drop_duplicates("Symbol").set_index("Symbol")["Name"]
+    return {s: clean_company_name(str(names.get(s, s))) for s in symbols}
+
+
+def record(symbols, path = FIXTURE_DIR):
+    '''
+    Fetch everything the benchmarks replay, live
+    '''
+    from dotenv import load_dotenv
+    from newsapi import NewsApiClient
+    from investopedia import get_investopedia_news
+
+    companies = _companies(symbols)
+    members = pd.read_csv(os.path.join(REPO_DIR, score.SNP500_PATH))["Symbol"].tolist()
+    infos = {s: info for s, info in fetch.get_infos(list(dict.fromkeys(symbols + members))).items()
+             if info is not None}
+    financials, histories = {}, {}
+    for symbol in symbols:
+        dat = yf.Ticker(symbol)
+        financials[symbol] = dat.financials.to_json(orient = "split", date_format = "iso")
+        histories[symbol] = dat.history(period = "1mo", interval = "1h")
+
+    load_dotenv()
+    news.newsapi = NewsApiClient(api_key = os.getenv("NEWSAPI_KEY"))
+    articles = {}
+    for company in dict.fromkeys(companies.values()):
+        urls = get_investopedia_news(company) + [a["url"] for a in news.get_all_news(company)["articles"]]
+        articles[company] = []
+        for url in dict.fromkeys(urls):
+            try:
+                articles[company].append((url, news.download(url)))
+            except Exception as e:
+                print(f"Skipping {url}: {e}")
+
+    NLP.get_model()  # Leaves the encoder weights in the local model cache for offline runs
+    write_fixtures(path, "recorded", market._fetch(), companies, infos, financials, histories, articles)
+    print(f"Recorded {len(symbols)} symbols, {len(infos)} infos, "
+          f"{sum(len(a) for a in articles.values())} articles to {path}")
+
+
+WORDS = ("revenue earnings guidance margin growth quarter analysts shares investors market demand supply "
+         "outlook profit forecast dividend buyback acquisition regulators chips cloud consumer retail energy "
+         "rates inflation fed bond yields credit debt cash flow segment strategy product launch customers "
+         "competition pricing costs layoffs hiring expansion lawsuit settlement partnership contract").split()
+
+
+def _sentence(rng):
+    words = rng.choice(WORDS, rng.integers(8, 26)).tolist()
+    return " ".join(words).capitalize() + rng.choice([".", ".", ".", "?", "!"])
+
+
+def _article_html(rng, company, i):
+    paragraphs = [" ".join(_sentence(rng) for _ in range(rng.integers(3, 6))) for _ in range(rng.integers(8, 15))]
+    body = "\n".join(f"<p>{p}</p>" for p in paragraphs)
+    return (f"<html><head><title>{company} update {i}</title>"
+            f'<meta name="author" content="Analyst {i % 7}">'
+            f'<meta property="article:published_time" content="2025-06-{1 + i % 28:02d}T12:00:00Z">'
+            f"</head><body><article><h1>{company} update {i}</h1>\n{body}\n</article></body></html>")
+
+
+def synthetic_fixtures(path, n_symbols = SYNTHETIC_SYMBOLS, n_articles = SYNTHETIC_ARTICLES, seed = SEED):
+    '''
+    Deterministic stand-in for a recording: random-walk bars, plausible fundamentals, generated articles
+    '''
+    rng = np.random.default_rng(seed)
+    sectors = pd.read_csv(os.path.join(REPO_DIR, score.SNP500_PATH))
+    symbols = sectors.groupby("GICS Sector")["Symbol"].first().tolist()
+    symbols = (symbols + [s for s in sectors["Symbol"] if s not in symbols])[:n_symbols]
+    companies = _companies(symbols)
+
+    infos = {}
+    for symbol in dict.fromkeys(symbols + sectors["Symbol"].tolist()):
+        cap = float(np.exp(rng.normal(24, 1.2)))
+        debt = cap * float(rng.uniform(0.05, 0.8))
+        infos[symbol] = {
+            "beta": float(rng.uniform(0.5, 1.8)),
+            "marketCap": cap,
+            "totalDebt": debt,
+            "enterpriseValue": cap + debt,
+            "ebitda": cap * float(rng.uniform(0.04, 0.2)),
+            "trailingPE": float(rng.uniform(8, 45)),
+            "priceToBook": float(rng.uniform(0.8, 12)),
+        }
+
+    financials, histories = {}, {}
+    days = pd.bdate_range(end = pd.Timestamp.now(tz = "America/New_York").normalize() - pd.Timedelta(days = 1), periods = 20)
+    times = pd.DatetimeIndex([d + pd.Timedelta(hours = 9, minutes = 30) + pd.Timedelta(hours = h)
+                              for d in days for h in range(7)], name = "Datetime")
+    for symbol in symbols:
+        columns = pd.date_range(end = "2024-12-31", periods = 4, freq = "YE")
+        financials[symbol] = pd.DataFrame(
+            [rng.uniform(1e8, 5e9, 4), rng.uniform(1e10, 1e11, 4)],
+            index = ["Interest Expense", "Total Revenue"], columns = columns,
+        ).to_json(orient = "split", date_format = "iso")
+        close = float(rng.uniform(20, 500)) * np.exp(np.cumsum(rng.normal(0, 0.004, len(times))))
+        histories[symbol] = pd.DataFrame({
+            "Open": close * (1 + rng.normal(0, 0.001, len(times))),
+            "High": close * 1.003,
+            "Low": close * 0.997,
+            "Close": close,
+            "Volume": rng.integers(1e5, 1e7, len(times)),
+        }, index = times)
+
+    articles = {}
+    for company in dict.fromkeys(companies.values()):
+        slug = re.sub(r"\W+", "-", company.lower())
+        articles[company] = [(f"https://news.example.com/{slug}/{i}", _article_html(rng, company, i))
+                             for i in range(n_articles)]
+    market_ref = {"rf": 0.043, "rm": 0.11, "vix": 17.5}
+    return write_fixtures(path, "synthetic", market_ref, companies, infos, financials, histories, articles)
+
+
+class FakeTicker:
+    '''
+    yf.Ticker replaying Ticker.info, financials and history from the fixtures
+    '''
+    fixtures = None
+
+    def __init__(self, ticker, session = None):
+        self.ticker = ticker
+
+    @property
+    def info(self):
+        info = self.fixtures.infos.get(self.ticker)
+        if info is None:
+            raise KeyError(f"No recorded info for {self.ticker}")
+        return dict(info)
+
+    @property
+    def financials(self):
+        return pd.read_json(io.StringIO(self.fixtures.financials[self.ticker]), orient = "split")
+
+    def history(self, period = "1mo", interval = "1d", **kwargs):
+        return prices._window(self.fixtures.history(self.ticker), period)
+
+
+def fake_download(symbols, interval = "1d", period = None, start = None, **kwargs):
+    '''
+    yf.download(group_by = "ticker") over the recorded bars
+    '''
+    frames = {}
+    for symbol in ([symbols] if isinstance(symbols, str) else symbols):
+        try:
+            df = FakeTicker.fixtures.history(symbol)
+        except KeyError:
+            continue
+        if start is not None:
+            df = df[df.index.tz_convert("UTC").tz_localize(None) >= pd.Timestamp(start)]
+        elif period is not None:
+            df = prices._window(df, period)
+        frames[symbol] = df
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, axis = 1)
+
+
+class FakeLLM:
+    '''
+    Answers instantly, shaped like both Groq (chat.completions.create) and
+    llm_batch clients (async complete, packed prompts get one line per company)
+    '''
+    SCORE = 0.25
+
+    def __init__(self, *args, **kwargs):
+        self.chat = SimpleNamespace(completions = SimpleNamespace(create = self._create))
+
+    def answer(self, content):
+        ids = re.findall(r"^\[(\d+)\] Company", content, re.MULTILINE)
+        if ids:
+            return "\n".join(f"{i}: Score: {self.SCORE}" for i in ids)
+        return f"The outlook is cautiously positive.\nScore: {self.SCORE}"
+
+    def _create(self, messages, model, stream = False, **kwargs):
+        text = self.answer(messages[-1]["content"])
+        if stream:
+            return (SimpleNamespace(choices = [SimpleNamespace(delta = SimpleNamespace(content = word))])
+                    for word in re.split(r"(?<=\s)", text))
+        return SimpleNamespace(choices = [SimpleNamespace(message = SimpleNamespace(content = text))])
+
+    async def complete(self, content):
+        return self.answer(content)
+
+
+@contextmanager
+def replay(fx):
+    FakeTicker.fixtures = fx
+    with ExitStack() as stack:
+        for target, value in [
+            ("yfinance.Ticker", FakeTicker),
+            ("yfinance.download", fake_download),
+            ("market._fetch", lambda: dict(fx.market)),
+            ("news.NewsApiClient", lambda api_key = None: None),
+            ("news.get_all_news", lambda query: {"articles": [{"url": url} for url in fx.urls(query)]}),
+            ("news.get_investopedia_news", lambda query: []),
+            ("news.download", fx.html),
+            ("llmAPI.get_client", FakeLLM),
+            ("llm_batch.GroqClient", FakeLLM),
+        ]:
+            stack.enter_context(mock.patch(target, value))
+        yield
+
+
+@contextmanager
+def workspace():
+    '''
+    Run in an empty working directory, so every ./cache, ./dump and ./vector_store starts cold
+    '''
+    cwd = os.getcwd()
+    path = tempfile.mkdtemp(prefix = "stockrec_bench_")
+    os.chdir(path)
+    score._context = score.ScoringContext(os.path.join(REPO_DIR, score.SNP500_PATH))
+    try:
+        yield path
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(path, ignore_errors = True)
+
+
+def reset_caches():
+    # A stream abandoned by the previous repetition is still being read and cached
+    for fut in list(llmAPI._inflight.values()):
+        fut.exception()
+    for name in ("cache", "dump", "vector_store"):
+        shutil.rmtree(name, ignore_errors = True)
+    with NLP._loaded_lock:
+        NLP._loaded.clear()
+    NLP._embedding_cache = None
+    market._reference = None
+
+
+def score_single(symbol, company):
+    '''
+    One recommendation the way app.py computes it after Submit
+    '''
+    dat = yf.Ticker(symbol)
+    hist = get_history(symbol, period = "5d", interval = "1h").reset_index()
+    _, model, _ = linRegVis(hist)
+    index_score = np.tanh(model.coef_[0] / 2)
+
+    def final(capm_wacc, multiples, news):
+        fin_score = 0.25 * sum(dict(multiples, capm_wacc = capm_wacc).values())
+        final_score = get_final_score({"fin": fin_score, "news": news[1], "index": index_score, "random": 0.0})
+        return final_score, get_decision(final_score)
+
+    stages = {
+        "capm": (lambda: capm(dat), []),
+        "wacc": (lambda capm: wacc(dat, capm), ["capm"]),
+        "capm_wacc": (lambda capm, wacc: capm_wacc_score(capm, wacc), ["capm", "wacc"]),
+        "multiples": (lambda: get_financial_scores(symbol), []),
+        "news": (lambda: llmAPI.get_scored_response(_q = company, query = f"{llmAPI.OUTLOOK_QUERY} {company}?"), []),
+        "final": (final, ["capm_wacc", "multiples", "news"]),
+    }
+    for stage, result, error in pipeline.run(stages):
+        if error is not None:
+            raise error
+    return result
+
+
+def measure(fn, repeat, setup = None, warmup = 0, verbose = False):
+    with ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(redirect_stdout(io.StringIO()))
+        for _ in range(warmup):
+            fn()
+        times = []
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - start) * 1000)
+    return {
+        "repeat": repeat,
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+    }
+
+
+def benchmarks(fx):
+    '''
+    (name, fn, setup, repeat, warmup, prepare); setup runs untimed before every
+    repetition (cache resets make the cold variants), prepare once before the benchmark
+    '''
+    symbol = fx.symbols[0]
+    company = fx.company(symbol)
+    pages = [(url, fx.html(url)) for url in fx.urls(company)]
+    texts = [a["text"] for a in (news.parse(url, html) for url, html in pages) if a is not None]
+    hist = FakeTicker(symbol).history(period = "5d").reset_index()
+    queries = [f"{llmAPI.OUTLOOK_QUERY} {company}?", f"{company} earnings guidance",
+               f"{company} debt and cash flow", f"Risks for {company}"]
+
+    search_inputs = {}
+
+    def prepare_search():
+        model, index, _ = NLP.embedding(company)
+        search_inputs["index"] = index
+        search_inputs["vectors"] = model.encode(queries).astype("float32")
+
+    def reset_sectors():
+        if os.path.exists("cache/sector_multiples.db"):
+            os.remove("cache/sector_multiples.db")
+
+    def reset_batch():
+        reset_caches()
+        for path in ("batch.parquet", "batch_checkpoint.jsonl"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    batch = lambda: screener.run(fx.symbols, workers = min(4, os.cpu_count()), checkpoint = "batch_checkpoint.jsonl",
+                                 output = "batch.parquet", news = True)
+
+    return [
+        ("parse_articles", lambda: [news.parse(url, html) for url, html in pages], None, 3, 1, None),
+        ("chunk_by_sentence", lambda: [NLP.chunk_by_sentence(t) for t in texts], None, 20, 1, None),
+        ("embedding_cold", lambda: NLP.embedding(company), reset_caches, 3, 0, None),
+        ("embedding_warm", lambda: NLP.embedding(company), None, 20, 1, None),
+        ("index_search", lambda: search_inputs["index"].search(search_inputs["vectors"], 5), None, 100, 0, prepare_search),
+        ("retrieve", lambda: NLP.retrieve(company, queries[0]), None, 20, 1, None),
+        ("linRegVis", lambda: linRegVis(hist), None, 50, 1, None),
+        ("financial_scores_cold", lambda: get_financial_scores(symbol), reset_sectors, 3, 0, None),
+        ("financial_scores_warm", lambda: get_financial_scores(symbol), None, 50, 1, None),
+        # What the user waits for before the answer starts rendering: retrieval, prompt and the first delta
+        ("first_token_cold", lambda: next(llmAPI.stream_response(company, queries[0])), reset_caches, 3, 0, None),
+        ("score_single_cold", lambda: score_single(symbol, company), reset_caches, 3, 0, None),
+        ("score_single_warm", lambda: score_single(symbol, company), None, 10, 1, None),
+        ("score_batch", batch, reset_batch, 2, 0, None),
+    ]
+
+
+def run(fixture_dir = FIXTURE_DIR, only = None, synthetic = False, verbose = False):
+    machine = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+    results = {}
+    with workspace() as workdir:
+        if synthetic or not os.path.exists(os.path.join(fixture_dir, "manifest.json")):
+            fixture_dir = synthetic_fixtures(os.path.join(workdir, "fixtures"))
+        fx = Fixtures(fixture_dir)
+        with replay(fx):
+            NLP.get_model()  # Model load is not part of any benchmark
+            for name, fn, setup, repeat, warmup, prepare in benchmarks(fx):
+                if only and not any(o in name for o in only):
+                    continue
+                if prepare is not None:
+                    with redirect_stdout(io.StringIO()):
+                        prepare()
+                results[name] = measure(fn, repeat, setup, warmup, verbose)
+                print(f"{name:24s} median {results[name]['median_ms']:10.3f} ms  min {results[name]['min_ms']:10.3f} ms")
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec = "seconds"),
+        "fixtures": fx.kind,
+        "machine": machine,
+        "results": results,
+    }
+
+
+def check(report, baseline = None, thresholds = None):
+    '''
+    Regressions: median over the baseline's by more than the tolerance, or over max_ms
+    A baseline recorded on other fixtures is not compared
+    '''
+    thresholds = thresholds or {}
+    if baseline is not None and baseline.get("fixtures") != report["fixtures"]:
+        print(f"Baseline was measured on {baseline.get('fixtures')} fixtures, not compared")
+        baseline = None
+    regressions = []
+    for name, r in report["results"].items():
+        tolerance = thresholds.get("tolerances", {}).get(name, thresholds.get("tolerance", 0.25))
+        max_ms = thresholds.get("max_ms", {}).get(name)
+        if max_ms is not None and r["median_ms"] > max_ms:
+            regressions.append({"benchmark": name, "median_ms": r["median_ms"], "limit_ms": max_ms, "reason": "max_ms"})
+        base = (baseline or {}).get("results", {}).get(name)
+        if base is not None and r["median_ms"] > base["median_ms"] * (1 + tolerance):
+            regressions.append({"benchmark": name, "median_ms": r["median_ms"],
+                                "limit_ms": round(base["median_ms"] * (1 + tolerance), 3), "reason": "baseline"})
+    return regressions
+
+
+def _load_json(path):
+    if path and os.path.exists(path):
+        with open(path, "r", encoding = "utf-8") as f:
+            return json.load(f)
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Offline pipeline benchmarks")
+    sub = parser.add_subparsers(dest = "command", required = True)
+    rec = sub.add_parser("record", help = "Record live fixtures")
+    rec.add_argument("symbols", nargs = "+")
+    rec.add_argument("--fixtures", default = FIXTURE_DIR)
+    for name in ("run", "baseline"):
+        p = sub.add_parser(name)
+        p.add_argument("--fixtures", default = FIXTURE_DIR)
+        p.add_argument("--synthetic", action = "store_true", help = "Ignore recorded fixtures")
+        p.add_argument("--only", nargs = "*", help = "Benchmarks whose name contains any of these")
+        p.add_argument("--verbose", action = "store_true", help = "Keep the pipeline's own output")
+        p.add_argument("--output", default = RESULTS_PATH if name == "run" else BASELINE_PATH)
+        p.add_argument("--baseline", default = BASELINE_PATH)
+        p.add_argument("--thresholds", default = THRESHOLDS_PATH)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.symbols, args.fixtures)
+        sys.exit(0)
+
+    # The replay patches have to reach the screener's worker processes
+    if "fork" in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method("fork", force = True)
+
+    report = run(args.fixtures, args.only, args.synthetic, args.verbose)
+    if args.command == "run":
+        report["regressions"] = check(report, _load_json(args.baseline), _load_json(args.thresholds))
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok = True)
+    with open(args.output, "w", encoding = "utf-8") as f:
+        json.dump(report, f, indent = 2)
+    print(f"Wrote {args.output}")
+
+    for r in report.get("regressions", []):
+        print(f"REGRESSION {r['benchmark']}: {r['median_ms']} ms > {r['limit_ms']} ms ({r['reason']})")
+    sys.exit(1 if report.get("regressions") else 0)
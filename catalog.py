@@ -0,0 +1,173 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+
+# Catalog of news dumps and their vector indexes, keyed by normalised query.
+# Replaces scanning ./dump and matching file names on every lookup.
+DB_PATH = os.path.join(".", "cache", "catalog.db")
+TTL = 24 * 3600      # Seconds a dump stays fresh
+RETENTION = 30 * 24 * 3600  # Seconds before an unused company index is dropped
+INDEX_DIR = os.path.join(".", "vector_store")
+MAX_ENTRIES = 500    # Least recently used entries beyond this are evicted
+
+
+_locks = {}  # query key -> lock held while the company's dump, index or chunks change
+_locks_lock = threading.Lock()
+
+
+def normalise(query):
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def company_lock(query):
+    '''
+    Per-company lock of this process, reentrant: held across fetching a dump and
+    indexing it, so a concurrent ingest never deletes a dump being read or
+    interleaves writes to the index and its chunk records
+    '''
+    with _locks_lock:
+        return _locks.setdefault(normalise(query), threading.RLock())
+
+
+def connect(path = DB_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    conn = sqlite3.connect(path, timeout = 30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("""CREATE TABLE IF NOT EXISTS dumps (
+        query_key TEXT PRIMARY KEY,
+        query TEXT NOT NULL,
+        path TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        article_count INTEGER NOT NULL,
+        content_hash TEXT NOT NULL,
+        index_path TEXT,
+        index_hash TEXT
+    )""")
+    return conn
+
+
+def lookup(query, ttl = TTL, path = DB_PATH):
+    '''
+    Return the catalog entry for query if its dump is fresh, else None
+    '''
+    conn = connect(path)
+    try:
+        row = conn.execute("SELECT * FROM dumps WHERE query_key = ?", (normalise(query),)).fetchone()
+        if row is None or row["fetched_at"] < time.time() - ttl or not os.path.exists(row["path"]):
+            return None
+        conn.execute("UPDATE dumps SET accessed_at = ? WHERE query_key = ?", (time.time(), row["query_key"]))
+        conn.commit()
+        return dict(row)
+    finally:
+        conn.close()
+
+
+def index_is_fresh(entry):
+    '''
+    The index was built from exactly the dump the entry points to
+    '''
+    return (
+        entry is not None
+        and entry["index_path"] is not None
+        and entry["index_hash"] == entry["content_hash"]
+        and os.path.exists(entry["index_path"])
+    )
+
+
+def has_index(query, path = DB_PATH):
+    '''
+    The company has a vector index on disk, fresh or not
+    '''
+    conn = connect(path)
+    try:
+        row = conn.execute("SELECT index_path FROM dumps WHERE query_key = ?", (normalise(query),)).fetchone()
+    finally:
+        conn.close()
+    return row is not None and row["index_path"] is not None and os.path.exists(row["index_path"])
+
+
+def _remove_files(*paths):
+    for p in paths:
+        if p and os.path.exists(p):
+            os.remove(p)
+
+
+def index_path(query, directory = INDEX_DIR):
+    '''
+    Company index file: a readable prefix plus a hash of the normalised key,
+    so keys differing only in punctuation ("a&b", "a b") never share files
+    '''
+    key = normalise(query)
+    prefix = re.sub(r"[^\w.-]+", "_", key)[:40].strip("_.") or "company"
+    return os.path.join(directory, f"{prefix}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.faiss")
+
+
+def chunks_path(index_path):
+    # Chunk records stored next to a company index, one per index row
+    return os.path.splitext(index_path)[0] + ".chunks.jsonl"
+
+
+def record_dump(query, dump_path, article_count, content_hash, path = DB_PATH):
+    '''
+    Register a new dump for query, replacing (and deleting) the previous dump
+    The company index is kept so the new dump can be appended to it
+    '''
+    key = normalise(query)
+    now = time.time()
+    conn = connect(path)
+    try:
+        old = conn.execute("SELECT path FROM dumps WHERE query_key = ?", (key,)).fetchone()
+        conn.execute(
+            "INSERT INTO dumps VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL) "
+            "ON CONFLICT (query_key) DO UPDATE SET query = excluded.query, path = excluded.path, "
+            "fetched_at = excluded.fetched_at, accessed_at = excluded.accessed_at, "
+            "article_count = excluded.article_count, content_hash = excluded.content_hash",
+            (key, query, dump_path, now, now, article_count, content_hash),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    if old is not None and old["path"] != dump_path:
+        _remove_files(old["path"])
+
+
+def record_index(query, index_path, content_hash, path = DB_PATH):
+    conn = connect(path)
+    try:
+        row = conn.execute("SELECT index_path FROM dumps WHERE query_key = ?", (normalise(query),)).fetchone()
+        conn.execute(
+            "UPDATE dumps SET index_path = ?, index_hash = ? WHERE query_key = ?",
+            (index_path, content_hash, normalise(query)),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    # Files of a name the company no longer uses, e.g. from before index_path() hashed keys
+    if row is not None and row["index_path"] and row["index_path"] != index_path:
+        _remove_files(row["index_path"], chunks_path(row["index_path"]))
+
+
+def evict(ttl = RETENTION, max_entries = MAX_ENTRIES, path = DB_PATH):
+    '''
+    Drop expired entries and the least recently used ones beyond max_entries,
+    deleting their dump and index files
+    '''
+    conn = connect(path)
+    try:
+        rows = conn.execute(
+            "SELECT query_key, path, index_path FROM dumps WHERE fetched_at < ? "
+            "UNION SELECT query_key, path, index_path FROM "
+            "(SELECT * FROM dumps ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (time.time() - ttl, max_entries),
+        ).fetchall()
+        conn.executemany("DELETE FROM dumps WHERE query_key = ?", [(r["query_key"],) for r in rows])
+        conn.commit()
+    finally:
+        conn.close()
+    for r in rows:
+        _remove_files(r["path"], r["index_path"], r["index_path"] and chunks_path(r["index_path"]))
+    return len(rows)
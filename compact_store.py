@@ -0,0 +1,333 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+import numpy as np
+
+# One shared on-disk vector store for every company, int8-quantized and memory-mapped.
+#   codes.i8      (n, dim) int8, symmetric per-vector quantization: v ~ scale * code
+#   scales.f32    (n,) scale per vector
+#   norms.f32     (n,) squared L2 norm of the dequantized vector
+#   company.u32   (n,) company id per row
+#   text.bin      chunk texts, UTF-8, back to back
+#   offsets.u64   (n + 1,) start of every text in text.bin; its length is the commit point
+#   store.db      SQLite: (company, hash) -> row, date / source, company ids and the
+#                 dump each company was last ingested from; also the write lock
+# Readers only map the files read-only: nothing is deserialised at startup and
+# worker processes share the pages through the OS page cache.
+STORE_DIR = os.path.join(".", "vector_store", "compact")
+BLOCK = 65536  # Rows dequantized per matmul during a full scan
+
+
+def quantize(vectors):
+    '''
+    (int8 codes, float32 scales, float32 squared norms of the dequantized vectors)
+    '''
+    vectors = np.ascontiguousarray(vectors, dtype = "float32")
+    scales = np.abs(vectors).max(axis = 1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    norms = (scales ** 2) * (codes.astype(np.float32) ** 2).sum(axis = 1)
+    return codes, scales.astype(np.float32), norms.astype(np.float32)
+
+
+class CompactStore:
+    FILES = {"codes": ("codes.i8", np.int8), "scales": ("scales.f32", np.float32),
+             "norms": ("norms.f32", np.float32), "company": ("company.u32", np.uint32)}
+
+    def __init__(self, dim, path = STORE_DIR):
+        self.dim = dim
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        self.db_path = os.path.join(path, "store.db")
+        self.offsets_path = os.path.join(path, "offsets.u64")
+        self.text_path = os.path.join(path, "text.bin")
+        self._lock = threading.Lock()
+        self._maps = None
+        self._mapped_rows = -1
+
+        if not os.path.exists(self.offsets_path):
+            with open(self.offsets_path, "wb") as f:
+                f.write(np.zeros(1, dtype = np.uint64).tobytes())
+        conn = self._connect()
+        conn.execute("""CREATE TABLE IF NOT EXISTS chunks (
+            company TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            row INTEGER NOT NULL,
+            date TEXT,
+            source TEXT,
+            PRIMARY KEY (company, hash)
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS chunks_row ON chunks (row)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS companies (
+            company TEXT PRIMARY KEY,
+            id INTEGER NOT NULL UNIQUE,
+            content_hash TEXT
+        )""")
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout = 60)
+
+    def _file(self, name):
+        return os.path.join(self.path, self.FILES[name][0])
+
+    def _rows_on_disk(self):
+        return os.path.getsize(self.offsets_path) // 8 - 1
+
+    def __len__(self):
+        return self._rows_on_disk()
+
+    def _open(self):
+        '''
+        Snapshot of the committed rows: read-only maps, company ids and each company's
+        row ids, rebuilt when the store grows. Callers hold self._lock
+        '''
+        rows = self._rows_on_disk()
+        if rows != self._mapped_rows:
+            maps = {"offsets": np.memmap(self.offsets_path, dtype = np.uint64, mode = "r", shape = (rows + 1,))}
+            for name, (_, dtype) in self.FILES.items():
+                shape = (rows, self.dim) if name == "codes" else (rows,)
+                maps[name] = np.memmap(self._file(name), dtype = dtype, mode = "r", shape = shape) if rows else \
+                    np.empty(shape, dtype = dtype)
+            maps["text"] = np.memmap(self.text_path, dtype = np.uint8, mode = "r") if rows and maps["offsets"][-1] else \
+                np.empty(0, dtype = np.uint8)
+            maps["companies"] = self._load_companies()
+            maps["rows"] = self._index_rows(maps["company"])
+            self._maps, self._mapped_rows = maps, rows
+        return self._maps
+
+    def _snapshot(self):
+        with self._lock:
+            return self._open()
+
+    def _load_companies(self):
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT company, id FROM companies"))
+        finally:
+            conn.close()
+
+    def _index_rows(self, company):
+        '''
+        {company id: sorted row ids}; rows are only ever appended, so only the
+        rows since the previous snapshot are grouped
+        '''
+        previous = self._maps["rows"] if self._maps is not None and 0 <= self._mapped_rows <= len(company) else {}
+        start = self._mapped_rows if previous else 0
+        tail = np.asarray(company[start:])
+        order = np.argsort(tail, kind = "stable")
+        cids, first = np.unique(tail[order], return_index = True)
+        index = dict(previous)
+        for cid, ids in zip(cids.tolist(), np.split(order + start, first[1:])):
+            index[cid] = np.concatenate([index[cid], ids]) if cid in index else ids
+        return index
+
+    def content_hash(self, company):
+        '''
+        Hash of the dump the company was last ingested from, None if never
+        '''
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT content_hash FROM companies WHERE company = ?", (company,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def add(self, company, records, vectors, content_hash = None):
+        '''
+        Append the company's chunks not stored yet; records: {"hash", "text", "date", "source"}
+        Returns the number of rows added
+        '''
+        conn = self._connect()
+        try:
+            # Write lock across processes while the files and the tables grow together
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT id FROM companies WHERE company = ?", (company,)).fetchone()
+            if row is None:
+                cid = conn.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM companies").fetchone()[0]
+                conn.execute("INSERT INTO companies VALUES (?, ?, NULL)", (company, cid))
+            else:
+                cid = row[0]
+            known = {h for (h,) in conn.execute("SELECT hash FROM chunks WHERE company = ?", (company,))}
+            keep, seen = [], set()
+            for i, r in enumerate(records):
+                if r["hash"] not in known and r["hash"] not in seen:
+                    seen.add(r["hash"])
+                    keep.append(i)
+
+            n = self._rows_on_disk()
+            if keep:
+                offsets = np.fromfile(self.offsets_path, dtype = np.uint64)
+                # Anything past the committed rows is a crashed append, cut it off first
+                for name, (_, dtype) in self.FILES.items():
+                    width = self.dim if name == "codes" else 1
+                    with open(self._file(name), "ab") as f:
+                        f.truncate(n * width * np.dtype(dtype).itemsize)
+                with open(self.text_path, "ab") as f:
+                    f.truncate(int(offsets[-1]))
+
+                codes, scales, norms = quantize(np.asarray(vectors)[keep])
+                texts = [records[i]["text"].encode("utf-8") for i in keep]
+                ends = offsets[-1] + np.cumsum([len(t) for t in texts], dtype = np.uint64)
+                for name, data in [("codes", codes), ("scales", scales), ("norms", norms),
+                                   ("company", np.full(len(keep), cid, dtype = np.uint32))]:
+                    with open(self._file(name), "ab") as f:
+                        f.write(data.tobytes())
+                with open(self.text_path, "ab") as f:
+                    f.write(b"".join(texts))
+                with open(self.offsets_path, "ab") as f:
+                    f.write(ends.astype(np.uint64).tobytes())  # Commit point for readers
+
+                conn.executemany(
+                    "INSERT INTO chunks VALUES (?, ?, ?, ?, ?)",
+                    [(company, records[i]["hash"], n + j, records[i].get("date"), records[i].get("source"))
+                     for j, i in enumerate(keep)],
+                )
+            if content_hash is not None:
+                conn.execute("UPDATE companies SET content_hash = ? WHERE company = ?", (content_hash, company))
+            conn.commit()
+        finally:
+            conn.close()
+        return len(keep)
+
+    def text(self, row, maps = None):
+        maps = maps or self._snapshot()
+        start, end = int(maps["offsets"][row]), int(maps["offsets"][row + 1])
+        return bytes(maps["text"][start:end]).decode("utf-8")
+
+    def record(self, row):
+        conn = self._connect()
+        try:
+            company, h, date, source = conn.execute(
+                "SELECT company, hash, date, source FROM chunks WHERE row = ?", (row,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return {"hash": h, "text": self.text(row), "date": date, "source": source, "company": company}
+
+    def rows(self, company, maps = None):
+        '''
+        Row ids of the company in the snapshot maps (the current one by default)
+        '''
+        maps = maps or self._snapshot()
+        cid = maps["companies"].get(company)
+        if cid is None:
+            # Rows and the company id are committed apart, a company new since the snapshot is looked up
+            cid = self._load_companies().get(company)
+        return maps["rows"].get(cid, np.empty(0, dtype = np.int64))
+
+    def search(self, query_vectors, k = 5, company = None):
+        '''
+        k nearest rows per query by squared L2 distance to the dequantized vectors,
+        over one company's rows or the whole store
+        Returns one [(distance, row)] list per query, nearest first
+        '''
+        maps = self._snapshot()
+        queries = np.ascontiguousarray(query_vectors, dtype = np.float32).reshape(-1, self.dim)
+        rows = self.rows(company, maps) if company is not None else None
+        total = len(rows) if rows is not None else maps["codes"].shape[0]
+        q_norms = (queries ** 2).sum(axis = 1)
+
+        best_d = np.full((len(queries), 0), np.inf, dtype = np.float32)
+        best_i = np.empty((len(queries), 0), dtype = np.int64)
+        for start in range(0, total, BLOCK):
+            ids = rows[start:start + BLOCK] if rows is not None else np.arange(start, min(start + BLOCK, total))
+            block = maps["codes"][ids] if rows is not None else maps["codes"][start:start + len(ids)]
+            dots = queries @ block.astype(np.float32).T * maps["scales"][ids]
+            dist = q_norms[:, None] - 2 * dots + maps["norms"][ids]
+            best_d = np.concatenate([best_d, dist], axis = 1)
+            best_i = np.concatenate([best_i, np.broadcast_to(ids, dist.shape)], axis = 1)
+            if best_d.shape[1] > k:
+                top = np.argpartition(best_d, k - 1, axis = 1)[:, :k]
+                best_d = np.take_along_axis(best_d, top, axis = 1)
+                best_i = np.take_along_axis(best_i, top, axis = 1)
+
+        order = np.argsort(best_d, axis = 1)
+        return [
+            [(float(d), int(i)) for d, i in zip(np.take_along_axis(best_d[q:q + 1], order[q:q + 1], axis = 1)[0],
+                                                 np.take_along_axis(best_i[q:q + 1], order[q:q + 1], axis = 1)[0])]
+            for q in range(len(queries))
+        ]
+
+    def sizes(self):
+        '''
+        Bytes on disk (and mapped) per component
+        '''
+        paths = {name: self._file(name) for name in self.FILES}
+        paths.update({"text": self.text_path, "offsets": self.offsets_path, "db": self.db_path})
+        return {name: os.path.getsize(p) if os.path.exists(p) else 0 for name, p in paths.items()}
+
+
+def evaluate(matrix, queries, texts = None, k = 10):
+    '''
+    Memory per million chunks and recall@k against exact float32 search,
+    for a temporary store built from matrix
+    '''
+    matrix = np.ascontiguousarray(matrix, dtype = np.float32)
+    queries = np.ascontiguousarray(queries, dtype = np.float32)
+    texts = texts if texts is not None else [""] * len(matrix)
+    with tempfile.TemporaryDirectory() as path:
+        store = CompactStore(matrix.shape[1], path)
+        records = [{"hash": str(i), "text": t} for i, t in enumerate(texts)]
+        start = time.perf_counter()
+        store.add("eval", records, matrix)
+        build_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = store.search(queries, k)
+        search_s = time.perf_counter() - start
+
+        dist = (queries ** 2).sum(axis = 1)[:, None] - 2 * queries @ matrix.T + (matrix ** 2).sum(axis = 1)
+        truth = np.argsort(dist, axis = 1)[:, :k]
+        recall = np.mean([len(set(t) & {i for _, i in f}) / k for t, f in zip(truth, found)])
+
+        n = len(matrix)
+        sizes = store.sizes()
+        mapped = sum(v for name, v in sizes.items() if name != "db")
+        text_bytes = sizes["text"]
+    return {
+        "n": n,
+        "dim": matrix.shape[1],
+        "build_s": round(build_s, 3),
+        "search_ms_per_query": round(1000 * search_s / len(queries), 4),
+        f"recall@{k}": round(float(recall), 4),
+        "vector_bytes_per_chunk": round((mapped - text_bytes) / n, 1),
+        "text_bytes_per_chunk": round(text_bytes / n, 1),
+        "mb_per_million": round(mapped / n * 1e6 / 2 ** 20, 1),
+        # IndexFlatL2 vectors alone, before the chunk texts held as Python strings
+        "float32_mb_per_million": round(matrix.shape[1] * 4 * 1e6 / 2 ** 20, 1),
+    }
+
+
+def build_from_indexes():
+    '''
+    Import every per-company chunk file into the compact store, vectors from the embedding cache
+    '''
+    from ann import load_company_records, cached_vectors
+    records, matrix = cached_vectors(load_company_records())
+    if not records:
+        raise ValueError("No company chunks to import, run a search first")
+    store = CompactStore(matrix.shape[1])
+    by_company = {}
+    for i, r in enumerate(records):
+        by_company.setdefault(r["company"], []).append(i)
+    added = sum(store.add(c, [records[i] for i in rows], matrix[rows]) for c, rows in by_company.items())
+    print(f"Imported {added} chunks of {len(by_company)} companies into {store.path}")
+    return store
+
+
+if __name__ == "__main__":
+    # python compact_store.py build  |  python compact_store.py report [n_queries]
+    if len(sys.argv) > 1 and sys.argv[1] == "report":
+        from ann import load_company_records, cached_vectors
+        records, matrix = cached_vectors(load_company_records())
+        n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        queries = matrix[np.random.default_rng(1).choice(len(matrix), min(n_queries, len(matrix)), replace = False)]
+        print(json.dumps(evaluate(matrix, queries, [r["text"] for r in records])))
+    else:
+        build_from_indexes()
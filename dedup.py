@@ -0,0 +1,261 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import numpy as np
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Near-duplicate detection for news ingestion, per company (normalised query).
+# URLs are canonicalised before download, parsed articles get a MinHash signature
+# over word shingles, banded for LSH. Signatures persist in SQLite, so a story
+# syndicated by several outlets, or already ingested by an earlier dump of the
+# same company, is dropped before chunking and encoding. A dump's articles count
+# as ingested only once NLP has committed its chunks to the index.
+DB_PATH = os.path.join(".", "cache", "dedup.db")
+RETENTION = 30 * 24 * 3600  # Seconds, same as the catalog's company indexes
+SHINGLE = 5        # Words per shingle
+NUM_PERM = 128     # MinHash permutations
+BANDS = 16         # LSH bands of NUM_PERM // BANDS rows, candidate threshold ~ (1 / 16) ** (1 / 8) = 0.71
+THRESHOLD = 0.8    # Estimated Jaccard similarity from which an article is a duplicate
+
+# Multiply-add-shift hashes of 64-bit shingle hashes: (a * x + b) mod 2^64, top 32 bits; a odd
+_rng = np.random.default_rng(1)
+_A = _rng.integers(0, np.iinfo(np.uint64).max, NUM_PERM, dtype = np.uint64, endpoint = True) | np.uint64(1)
+_B = _rng.integers(0, np.iinfo(np.uint64).max, NUM_PERM, dtype = np.uint64, endpoint = True)
+
+TRACKING = re.compile(
+    r"^(utm_\w+|fbclid|gclid|dclid|mc_cid|mc_eid|cmpid|smid|taid|ocid|guccounter|guce_\w+|ref|ref_src|src|mod|rss|feature)$",
+    re.IGNORECASE,
+)
+
+
+def canonical_url(url):
+    '''
+    One spelling per page: https, lower-case host without www / amp,
+    no fragment, default port, tracking parameters or trailing slash / AMP suffix
+    '''
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme == "http":
+        scheme = "https"
+    host = (parts.hostname or "").lower()
+    host = re.sub(r"^(www\d*|amp|m)\.", "", host)
+    try:
+        port = parts.port
+    except ValueError:
+        # Malformed port, e.g. "x.com:abc": keep the netloc as written
+        port, host = None, parts.netloc.lower()
+    if port and port not in (80, 443):
+        host = f"{host}:{port}"
+    path = re.sub(r"/{2,}", "/", parts.path)
+    path = re.sub(r"(/amp|\.amp|/index\.html?)$", "", path, flags = re.IGNORECASE).rstrip("/") or "/"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values = True) if not TRACKING.match(k))
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def text_hash(text):
+    return hashlib.sha1(" ".join(re.findall(r"\w+", text.lower())).encode("utf-8")).hexdigest()
+
+
+def shingles(text, size = SHINGLE):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(text):
+    '''
+    uint32 MinHash signature of the text's word shingles, None for an empty text
+    '''
+    grams = shingles(text)
+    if not grams:
+        return None
+    x = np.fromiter((int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size = 8).digest(), "little")
+                     for g in grams), dtype = np.uint64, count = len(grams))
+    # uint64 arithmetic wraps, i.e. is already mod 2^64
+    hashed = (np.outer(x, _A) + _B) >> np.uint64(32)
+    return hashed.min(axis = 0).astype(np.uint32)
+
+
+def similarity(a, b):
+    # Estimated Jaccard similarity of the two shingle sets
+    return float(np.mean(a == b))
+
+
+def _buckets(sig):
+    rows = NUM_PERM // BANDS
+    # Band number mixed into the key, so one indexed column holds every band
+    return [
+        int.from_bytes(hashlib.blake2b(bytes([band]) + sig[band * rows:(band + 1) * rows].tobytes(),
+                                       digest_size = 8).digest(), "big", signed = True)
+        for band in range(BANDS)
+    ]
+
+
+def connect(path = DB_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    conn = sqlite3.connect(path, timeout = 30)
+    conn.execute("""CREATE TABLE IF NOT EXISTS articles (
+        query_key TEXT NOT NULL,
+        url TEXT NOT NULL,
+        text_hash TEXT NOT NULL,
+        signature BLOB NOT NULL,
+        created_at REAL NOT NULL,
+        dump TEXT,
+        PRIMARY KEY (query_key, url)
+    )""")
+    if "dump" not in {row[1] for row in conn.execute("PRAGMA table_info(articles)")}:
+        conn.execute("ALTER TABLE articles ADD COLUMN dump TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS articles_text ON articles (query_key, text_hash)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS buckets (
+        query_key TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        url TEXT NOT NULL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS buckets_key ON buckets (query_key, bucket)")
+    return conn
+
+
+class Deduper:
+    '''
+    Articles already ingested for one company, by canonical URL and by content
+    Articles added from a dump stay pending, tagged with the dump, until commit()
+    once the dump is indexed; pending articles of other dumps are ignored, so an
+    article whose dump never reached the index is fetched again
+    '''
+    def __init__(self, query_key, threshold = THRESHOLD, path = DB_PATH, dump = None):
+        self.key = query_key
+        self.threshold = threshold
+        self.path = path
+        self.dump = dump
+
+    def _visible(self, alias = ""):
+        # Committed articles and the ones pending from this dump
+        return f"({alias}dump IS NULL OR {alias}dump = ?)"
+
+    def reset(self, keep_pending = False):
+        '''
+        Forget every article of the company, e.g. when its index is gone or rebuilt
+        keep_pending: keep the articles of this dump, about to be committed
+        '''
+        conn = connect(self.path)
+        try:
+            if keep_pending:
+                conn.execute("DELETE FROM articles WHERE query_key = ? AND dump IS NOT ?", (self.key, self.dump))
+            else:
+                conn.execute("DELETE FROM articles WHERE query_key = ?", (self.key,))
+            conn.execute(
+                "DELETE FROM buckets WHERE query_key = ? AND NOT EXISTS (SELECT 1 FROM articles a "
+                "WHERE a.query_key = buckets.query_key AND a.url = buckets.url)", (self.key,)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def discard_pending(self):
+        '''
+        Drop the pending articles of earlier dumps, they never made it into the index
+        '''
+        conn = connect(self.path)
+        try:
+            conn.execute("DELETE FROM articles WHERE query_key = ? AND dump IS NOT NULL AND dump IS NOT ?",
+                         (self.key, self.dump))
+            conn.execute(
+                "DELETE FROM buckets WHERE query_key = ? AND NOT EXISTS (SELECT 1 FROM articles a "
+                "WHERE a.query_key = buckets.query_key AND a.url = buckets.url)", (self.key,)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def commit(self):
+        '''
+        Mark this dump's articles ingested, once its chunks are in the index
+        '''
+        conn = connect(self.path)
+        try:
+            n = conn.execute("UPDATE articles SET dump = NULL WHERE query_key = ? AND dump = ?",
+                             (self.key, self.dump)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return n
+
+    def new_urls(self, urls):
+        '''
+        urls minus repeats (after canonicalisation) and pages already ingested, in order
+        '''
+        conn = connect(self.path)
+        try:
+            known = {row[0] for row in conn.execute(
+                f"SELECT url FROM articles WHERE query_key = ? AND {self._visible()}", (self.key, self.dump)
+            )}
+        finally:
+            conn.close()
+        fresh = []
+        for url in urls:
+            canonical = canonical_url(url)
+            if canonical not in known:
+                known.add(canonical)
+                fresh.append(url)
+        return fresh
+
+    def add(self, url, text):
+        '''
+        Register a parsed article as pending for this dump; returns the canonical URL
+        of the article it duplicates (exact text or estimated similarity >= threshold), else None
+        '''
+        canonical = canonical_url(url)
+        digest = text_hash(text)
+        sig = minhash(text)
+        if sig is None:
+            return None
+        buckets = _buckets(sig)
+
+        conn = connect(self.path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")  # Check and insert as one step across processes
+            row = conn.execute(
+                f"SELECT url FROM articles WHERE query_key = ? AND text_hash = ? AND {self._visible()} LIMIT 1",
+                (self.key, digest, self.dump),
+            ).fetchone()
+            if row is not None:
+                conn.rollback()
+                return row[0]
+
+            placeholders = ",".join("?" * len(buckets))
+            candidates = conn.execute(
+                f"SELECT DISTINCT a.url, a.signature FROM buckets b JOIN articles a "
+                f"ON a.query_key = b.query_key AND a.url = b.url "
+                f"WHERE b.query_key = ? AND b.bucket IN ({placeholders}) AND {self._visible('a.')}",
+                (self.key, *buckets, self.dump),
+            ).fetchall()
+            for other, blob in candidates:
+                if similarity(sig, np.frombuffer(blob, dtype = np.uint32)) >= self.threshold:
+                    conn.rollback()
+                    return other
+
+            conn.execute("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?)",
+                         (self.key, canonical, digest, sig.tobytes(), time.time(), self.dump))
+            conn.execute("DELETE FROM buckets WHERE query_key = ? AND url = ?", (self.key, canonical))
+            conn.executemany("INSERT INTO buckets VALUES (?, ?, ?)", [(self.key, b, canonical) for b in buckets])
+            conn.commit()
+            return None
+        finally:
+            conn.close()
+
+
+def evict(ttl = RETENTION, path = DB_PATH):
+    conn = connect(path)
+    try:
+        n = conn.execute("DELETE FROM articles WHERE created_at < ?", (time.time() - ttl,)).rowcount
+        conn.execute(
+            "DELETE FROM buckets WHERE NOT EXISTS (SELECT 1 FROM articles a "
+            "WHERE a.query_key = buckets.query_key AND a.url = buckets.url)"
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return n
@@ -0,0 +1,115 @@
+import os
+import re
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from tracing import span
+
+# Content-addressed cache of chunk embeddings.
+# Vectors live in one append-only float32 file read through np.memmap,
+# a SQLite table maps sha1(chunk text) -> row in that file.
+CACHE_DIR = os.path.join(".", "cache", "embeddings")
+
+
+def chunk_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, model_name, dim, cache_dir = CACHE_DIR):
+        name = re.sub(r"[^\w.-]+", "_", model_name)
+        os.makedirs(cache_dir, exist_ok = True)
+        self.dim = dim
+        self.matrix_path = os.path.join(cache_dir, f"{name}.f32")
+        self.db_path = os.path.join(cache_dir, f"{name}.db")
+        self._lock = threading.Lock()
+        self._matrix = None
+
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS rows (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout = 60)
+
+    def _rows_on_disk(self):
+        if not os.path.exists(self.matrix_path):
+            return 0
+        return os.path.getsize(self.matrix_path) // (self.dim * 4)
+
+    def matrix(self):
+        '''
+        Read-only memory map over every cached vector, reopened when it grows
+        '''
+        rows = self._rows_on_disk()
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            if rows == 0:
+                return np.empty((0, self.dim), dtype = "float32")
+            self._matrix = np.memmap(self.matrix_path, dtype = "float32", mode = "r", shape = (rows, self.dim))
+        return self._matrix
+
+    @staticmethod
+    def _select(conn, hashes):
+        found = {}
+        for i in range(0, len(hashes), 500):  # SQLite variable limit
+            batch = hashes[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            found.update(conn.execute(f"SELECT hash, row FROM rows WHERE hash IN ({placeholders})", batch))
+        return found
+
+    def lookup(self, hashes):
+        '''
+        Return {hash: row} for the hashes already cached
+        '''
+        conn = self._connect()
+        try:
+            return self._select(conn, hashes)
+        finally:
+            conn.close()
+
+    def _append(self, hashes, vectors):
+        conn = self._connect()
+        try:
+            # Write lock across processes while the file and the table grow together
+            conn.execute("BEGIN IMMEDIATE")
+            existing = self._select(conn, hashes)
+            keep = [i for i, h in enumerate(hashes) if h not in existing]
+            if not keep:
+                return
+            # Rows past the last committed one are a crashed append (maybe a partial row), cut them off
+            start = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM rows").fetchone()[0]
+            with open(self.matrix_path, "ab") as f:
+                f.truncate(start * self.dim * 4)
+                f.write(np.ascontiguousarray(vectors[keep], dtype = "float32").tobytes())
+            conn.executemany(
+                "INSERT INTO rows VALUES (?, ?)",
+                [(hashes[i], start + n) for n, i in enumerate(keep)],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def encode(self, model, chunks, batch_size = 32):
+        '''
+        Embeddings for chunks as a float32 (n, dim) array,
+        only chunks never seen before go through the encoder
+        '''
+        hashes = [chunk_hash(c) for c in chunks]
+        with span("nlp.encode", n = len(hashes)) as s, self._lock:
+            rows = self.lookup(hashes)
+            missing = list(dict.fromkeys(h for h in hashes if h not in rows))
+            s.set(cache = "miss" if missing else "hit", encoded = len(missing))
+            if missing:
+                text = {h: c for h, c in zip(hashes, chunks)}
+                vectors = np.asarray(
+                    model.encode([text[h] for h in missing], batch_size = batch_size, show_progress_bar = True),
+                    dtype = "float32",
+                )
+                self._append(missing, vectors)
+                rows = self.lookup(hashes)
+                s.set(bytes = vectors.nbytes)
+                print(f"Encoded {len(missing)} new chunks, {len(set(hashes)) - len(missing)} from cache")
+            matrix = self.matrix()
+        return np.array(matrix[[rows[h] for h in hashes]], dtype = "float32").reshape(-1, self.dim)
@@ -0,0 +1,85 @@
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import yfinance as yf
+from tracing import span, bind
+
+# yfinance keeps one process-wide HTTP session (YfData is a singleton),
+# so every Ticker created here reuses the same connection pool.
+YAHOO_HOST = "query2.finance.yahoo.com"
+
+MAX_WORKERS = 32  # Threads in the shared fetch pool
+HOST_LIMIT = 16   # Concurrent requests allowed against one host
+RETRIES = 3
+BACKOFF = 0.5     # Seconds, doubled after every failed attempt
+
+_pool = ThreadPoolExecutor(max_workers = MAX_WORKERS, thread_name_prefix = "fetch")
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+
+class _Host:
+    def __init__(self, limit):
+        self.sem = threading.BoundedSemaphore(limit)
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+
+@contextmanager
+def host_slot(host, limit = HOST_LIMIT, interval = 0.0):
+    '''
+    Hold one of the `limit` concurrent slots for `host`,
+    requests to the same host start at least `interval` seconds apart
+    '''
+    with _hosts_lock:
+        h = _hosts.get(host)
+        if h is None:
+            h = _hosts[host] = _Host(limit)
+    with h.sem:
+        if interval:
+            with h.lock:
+                now = time.monotonic()
+                wait = h.next_time - now
+                h.next_time = max(now, h.next_time) + interval
+            if wait > 0:
+                time.sleep(wait)
+        yield
+
+
+def retry(fn, retries = RETRIES, backoff = BACKOFF):
+    '''
+    Call fn() and retry with exponential backoff on any exception
+    '''
+    for attempt in range(retries):
+        try:
+            return fn()
+        except Exception:
+            if attempt == retries - 1:
+                raise
+            time.sleep(backoff * (2 ** attempt))
+
+
+def get_info(symbol):
+    '''
+    Read Ticker.info once, bounded by the per-host limit
+    '''
+    with span("yfinance.info", symbol = symbol), host_slot(YAHOO_HOST):
+        return retry(lambda: yf.Ticker(symbol).info)
+
+
+def _safe_info(symbol):
+    try:
+        return get_info(symbol)
+    except Exception as e:
+        print(f"Failed to fetch info for {symbol}: {e}")
+        return None
+
+
+def get_infos(symbols):
+    '''
+    Fetch Ticker.info for many symbols concurrently
+    Returns {symbol: info}, info is None when the fetch failed
+    '''
+    symbols = list(symbols)
+    return dict(zip(symbols, _pool.map(bind(_safe_info), symbols)))
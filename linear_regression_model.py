@@ -1,7 +1,6 @@
 import numpy as np
 import pandas as pd
 import altair as alt
-from sklearn.linear_model import LinearRegression
 
 def get_selectors_chart(hist: pd.DataFrame, nearest):
     # Return an invisible selectors chart for Altair hover.
@@ -20,18 +19,126 @@ def get_points_chart(line, nearest):
     )
 
 
-def linRegVis(hist: pd.DataFrame) -> pd.DataFrame:
+class TrendModel:
+    """
+    Least-squares line of log(Close / first Close) on hours since the first bar
+    Exposes coef_, intercept_ and predict() like sklearn's LinearRegression
+    """
+    def __init__(self, slope: float, intercept: float):
+        self.coef_ = np.array([slope])
+        self.intercept_ = intercept
+
+    def predict(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=float).reshape(-1, 1)
+        return self.intercept_ + self.coef_[0] * X[:, 0]
+
+
+def fit_trends(x: np.ndarray, y: np.ndarray):
+    """
+    Closed-form OLS of every row of y on the matching row of x in one pass
+    x, y: (tickers, hours), NaN in y marks a missing bar
+    Returns slopes and intercepts, one per row
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+    mask = ~np.isnan(y)
+    n = mask.sum(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = np.where(mask, x, 0).sum(axis=1) / n
+        y_mean = np.where(mask, y, 0).sum(axis=1) / n
+        dx = np.where(mask, x - x_mean[:, None], 0)
+        dy = np.where(mask, y - y_mean[:, None], 0)
+        sxx = (dx * dx).sum(axis=1)
+        slope = np.where(sxx > 0, (dx * dy).sum(axis=1) / sxx, 0.0)
+    intercept = y_mean - slope * x_mean
+    return slope, intercept
+
+
+def rolling_slopes(x: np.ndarray, y: np.ndarray, window: int, min_points: int = 2) -> np.ndarray:
+    """
+    OLS slope of y on x over the trailing `window` columns ending at every column,
+    all rows at once from running sums (no per-window fit)
+    x: (columns,) shared abscissa, y: (rows, columns), NaN in y marks a missing bar
+    Returns (rows, columns), NaN where a window has fewer than min_points bars
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    x = np.asarray(x, dtype=float)
+    x = x - x[0]  # Keeps the running sums small
+    mask = ~np.isnan(y)
+    xs = np.where(mask, x, 0.0)
+    ys = np.where(mask, y, 0.0)
+
+    cols = np.arange(y.shape[1])
+    lo = np.maximum(cols + 1 - window, 0)
+
+    def window_sum(a):
+        c = np.concatenate([np.zeros((a.shape[0], 1)), np.cumsum(a, axis=1)], axis=1)
+        return c[:, cols + 1] - c[:, lo]
+
+    n = window_sum(mask.astype(float))
+    sx, sy = window_sum(xs), window_sum(ys)
+    sxx, sxy = window_sum(xs * xs), window_sum(xs * ys)
+    den = n * sxx - sx * sx
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (n * sxy - sx * sy) / den
+    return np.where((n >= min_points) & (den > 1e-9 * np.maximum(n * sxx, 1)), slope, np.nan)
+
+
+def trend_scores(prices: np.ndarray, hours: np.ndarray, horizon: float = 120) -> dict:
+    """
+    Trend regression for many tickers from one aligned price matrix
+    prices: (tickers, hours) Close prices, NaN where a ticker has no bar
+    hours: (hours,) bar times in hours (any origin)
+    horizon: hours after each ticker's last bar to predict, 120 = 5 days
+    """
+    prices = np.atleast_2d(np.asarray(prices, dtype=float))
+    hours = np.asarray(hours, dtype=float)
+    valid = ~np.isnan(prices)
+    rows = np.arange(prices.shape[0])
+
+    # Each ticker is measured from its own first bar, as in the single-ticker fit
+    first = valid.argmax(axis=1)
+    initial_price = prices[rows, first]
+    x = hours[None, :] - hours[first][:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        y = np.log(prices / initial_price[:, None])
+    slope, intercept = fit_trends(x, y)
+
+    last = np.where(valid, x, -np.inf).max(axis=1)
+    prediction = initial_price * np.exp(intercept + slope * (last + horizon))
+    return {
+        "slope": slope,
+        "intercept": intercept,
+        "initial_price": initial_price,
+        "prediction": prediction,
+        "index_score": np.tanh(slope / 2),
+    }
+
+
+def fit_trend(hist: pd.DataFrame):
+    """
+    Fit one ticker's hourly history, no plot data is built
+    """
     time_in_hours = (hist['Datetime'] - hist['Datetime'].iloc[0]).dt.total_seconds() / 3600.0
-    X = time_in_hours.values.reshape(-1, 1)
     y = np.log(hist['Close'] / hist['Close'].iloc[0])
-    model = LinearRegression().fit(X, y)
+    slope, intercept = fit_trends(time_in_hours.values, y.values)
+    return TrendModel(slope[0], intercept[0]), hist['Close'].iloc[0]
+
 
-    hist = hist.copy()
-    hist['PredictedLogClose'] = model.predict(X)
-    hist['PredictedClose'] = hist['Close'].iloc[0] * np.exp(hist['PredictedLogClose'])
+def get_plot_data(hist: pd.DataFrame, model: TrendModel) -> pd.DataFrame:
+    """
+    Actual and regression prices in long format for the Altair chart
+    """
+    time_in_hours = (hist['Datetime'] - hist['Datetime'].iloc[0]).dt.total_seconds() / 3600.0
+    predicted = hist['Close'].iloc[0] * np.exp(model.predict(time_in_hours.values))
+    return pd.DataFrame({
+        'Datetime': pd.concat([hist['Datetime'], hist['Datetime']], ignore_index=True),
+        'Close': np.concatenate([hist['Close'].values, predicted]),
+        'Type': ['Actual'] * len(hist) + ['Regression'] * len(hist),
+    })
 
-    plot_data = pd.concat([
-        hist[['Datetime', 'Close']].assign(Type='Actual'),
-        hist[['Datetime', 'PredictedClose']].rename(columns={'PredictedClose': 'Close'}).assign(Type='Regression')
-    ])
-    return plot_data, model, hist['Close'].iloc[0]
\ No newline at end of file
+
+def linRegVis(hist: pd.DataFrame) -> pd.DataFrame:
+    model, initial_price = fit_trend(hist)
+    return get_plot_data(hist, model), model, initial_price
@@ -1,62 +1,281 @@
 import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import itertools
+import queue
+from concurrent.futures import Future
 from groq import Groq
-from NLP import embedding
+from NLP import retrieve
+from embed_cache import chunk_hash
+from tracing import span, record, bind
+from score import parse_score
 from dotenv import load_dotenv
 
-def get_response(_q, query):
-    load_dotenv()
+MODEL = "llama-3.1-8b-instant"
+# https://console.groq.com/docs/model/llama-3.1-8b-instant
 
-    # Get the embedding model, vector index, and flattened document chunks
-    model, index, flattened_chunks = embedding(_q)
+OUTLOOK_QUERY = "What are the latest news and outlook for"
+OUTLOOK_TEMPLATE = """You are a professional financial analyst.
 
-    # Encode the query into a vector
-    query_vector = model.encode([query]).astype("float32")
+                        Here is the user's question:
+                        {query}
 
-    # Perform vector search to retrieve the top 5 most similar chunks
-    D, I = index.search(query_vector, k = 5)
+                        Below is a collection of news articles related to the company "{company}":
+                        {news}
 
-    relevant_news = []
+                        Please answer the question based on the information above in a clear, professional, and well-reasoned manner.
+                        And give a score between -1 and 1, where -1 means "strongly negative" and 1 means "strongly positive", in the format "Score: X", where X is the score.
+                        """
 
-    for score, idx in zip(D[0], I[0]):
-        relevant_news.append(flattened_chunks[idx])
+# Persistent response cache, keyed by model, prompt template and retrieved chunks
+CACHE_PATH = os.path.join(".", "cache", "llm.db")
+CACHE_TTL = 6 * 3600  # Seconds
+EVICT_EVERY = 100     # cache_put calls between evictions of expired answers
 
-    client = Groq(api_key = os.getenv("GROQ_API_KEY"))
+_inflight = {}  # key -> Future of the one call in progress
+_inflight_lock = threading.Lock()
+_puts = itertools.count()
 
-    if "What are the latest news and outlook for" in query:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"""You are a professional financial analyst.
 
-                        Here is the user's question:
-                        {query}
+def _connect(path = CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    conn = sqlite3.connect(path, timeout = 30)
+    conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        text TEXT NOT NULL,
+        score REAL,
+        created_at REAL NOT NULL
+    )""")
+    return conn
 
-                        Below is a collection of news articles related to the company "{_q}":
-                        {relevant_news}
 
-                        Please answer the question based on the information above in a clear, professional, and well-reasoned manner.
-                        And give a score between -1 and 1, where -1 means "strongly negative" and 1 means "strongly positive", in the format "Score: X", where X is the score.
-                        """
-            }
-            ],
-            model = "llama-3.1-8b-instant",
-            # https://console.groq.com/docs/model/llama-3.1-8b-instant
-        )
+def cache_get(key, ttl = CACHE_TTL, path = CACHE_PATH, scored = False):
+    '''
+    scored: the prompt asks for a score, an answer stored without one is a miss
+    '''
+    conn = _connect(path)
+    try:
+        row = conn.execute(
+            "SELECT text, score FROM responses WHERE key = ? AND created_at >= ?",
+            (key, time.time() - ttl),
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is not None and scored and row[1] is None:
+        return None
+    return row
+
+
+def is_scored(query):
+    # Outlook questions ask for "Score: X", free chat questions do not
+    return OUTLOOK_QUERY in query
+
+
+def cache_put(key, text, score, path = CACHE_PATH):
+    conn = _connect(path)
+    try:
+        conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, text, score, time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+    # Expired rows are only skipped by reads, prune them on the first write and every EVICT_EVERY after
+    if next(_puts) % EVICT_EVERY == 0:
+        cache_evict(path = path)
+
+
+def cache_evict(ttl = CACHE_TTL, path = CACHE_PATH):
+    conn = _connect(path)
+    try:
+        n = conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - ttl,)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return n
 
+
+def cache_key(model, template, *parts, chunk_ids = ()):
+    chunks = hashlib.sha256("\n".join(chunk_ids).encode("utf-8")).hexdigest()
+    template = hashlib.sha256(template.encode("utf-8")).hexdigest()
+    return hashlib.sha256(json.dumps([model, template, chunks, *parts]).encode("utf-8")).hexdigest()
+
+
+def coalesce(key, fn):
+    '''
+    Run fn() once for concurrent callers with the same key, the others wait for its result
+    '''
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        leader = fut is None
+        if leader:
+            fut = _inflight[key] = Future()
+    if not leader:
+        return fut.result()
+    try:
+        result = fn()
+        fut.set_result(result)
+        return result
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def get_client():
+    load_dotenv()
+    return Groq(api_key = os.getenv("GROQ_API_KEY"))
+
+
+def outlook_prompt(_q, query, relevant_news):
+    content = OUTLOOK_TEMPLATE.format(query = query, company = _q, news = relevant_news)
+    key = cache_key(MODEL, OUTLOOK_TEMPLATE, _q, query, chunk_ids = [chunk_hash(c) for c in relevant_news])
+    return content, key
+
+
+def build_prompt(_q, query):
+    '''
+    (prompt content, cache key) for a question about company _q
+    '''
+    if OUTLOOK_QUERY in query:
+        # Top 5 chunks from the warm per-company index (model and index stay loaded)
+        relevant_news = retrieve(_q, query, k = 5)
+        content, key = outlook_prompt(_q, query, relevant_news)
     else:
+        content = query
+        key = cache_key(MODEL, "{query}", query)
+    return content, key
+
+
+def complete(client, content):
+    with span("llm.call", model = MODEL, bytes = len(content)) as s:
         chat_completion = client.chat.completions.create(
             messages=[
                 {
                     "role": "user",
-                    "content": query
+                    "content": content
             }
             ],
-            model = "llama-3.1-8b-instant",
-            # https://console.groq.com/docs/model/llama-3.1-8b-instant
+            model = MODEL,
         )
+        text = chat_completion.choices[0].message.content
+        s.set(answer_bytes = len(text or ""))
+    return text
+
+
+def stream_complete(client, content):
+    '''
+    Yield the answer's text deltas as Groq generates them
+    '''
+    start = time.perf_counter()
+    first, n = None, 0
+    stream = client.chat.completions.create(
+        messages = [{"role": "user", "content": content}],
+        model = MODEL,
+        stream = True,
+    )
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            if first is None:
+                first = time.perf_counter() - start
+            n += len(delta)
+            yield delta
+    # Recorded once done, a span left open across yields would parent the consumer's spans
+    record("llm.call", time.perf_counter() - start, model = MODEL, bytes = len(content), stream = True,
+           first_token_ms = round(1000 * first, 3) if first is not None else None, answer_bytes = n)
+
+
+def _drain(key, fut, deltas, client, content, scored):
+    '''
+    Read the whole stream into deltas, then cache the answer and resolve fut
+    Runs in its own thread, so the answer is complete even if the reader stops early
+    '''
+    try:
+        parts = []
+        for delta in stream_complete(client or get_client(), content):
+            parts.append(delta)
+            deltas.put(delta)
+        text = "".join(parts)
+        score = parse_score(text)
+        # An outlook answer without a score is not cached, the next request asks again
+        if score is not None or not scored:
+            cache_put(key, text, score)
+        fut.set_result((text, score))
+        deltas.put(None)
+    except BaseException as e:
+        fut.set_exception(e)
+        deltas.put(e)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def stream_response(_q, query, client = None):
+    '''
+    Yield the answer as it is generated; a cached answer, or one another caller
+    is already streaming, comes whole. The stream is read to the end and cached
+    even when the caller stops early, so batch callers of get_scored_response reuse it
+    '''
+    content, key = build_prompt(_q, query)
+    scored = is_scored(query)
+    row = cache_get(key, scored = scored)
+    if row is not None:
+        yield row[0]
+        return
+
+    # Same in-flight table as coalesce(): concurrent callers share one LLM call
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        leader = fut is None
+        if leader:
+            fut = _inflight[key] = Future()
+    if not leader:
+        yield fut.result()[0]
+        return
+
+    deltas = queue.Queue()
+    threading.Thread(target = bind(_drain), args = (key, fut, deltas, client, content, scored),
+                     daemon = True).start()
+    while True:
+        delta = deltas.get()
+        if delta is None:
+            return
+        if isinstance(delta, BaseException):
+            raise delta
+        yield delta
+
+
+def get_scored_response(_q, query, client = None):
+    '''
+    (answer text, parsed score or None), served from the cache while the
+    retrieved chunks are unchanged; concurrent misses share one LLM call
+    '''
+    # cache: hit, also when waiting on a coalesced call; miss when this caller reaches the LLM
+    with span("llm.response", query = _q, cache = "hit") as s:
+        content, key = build_prompt(_q, query)
+        scored = is_scored(query)
+
+        def call():
+            row = cache_get(key, scored = scored)
+            if row is not None:
+                return row
+            s.set(cache = "miss")
+            text = complete(client or get_client(), content)
+            score = parse_score(text)
+            # An outlook answer without a score is not cached, the next request asks again
+            if score is not None or not scored:
+                cache_put(key, text, score)
+            return text, score
 
-    # Batch processing required later
+        row = cache_get(key, scored = scored)
+        if row is not None:
+            return row
+        return coalesce(key, call)
 
-    return chat_completion.choices[0].message.content
 
+def get_response(_q, query, client = None):
+    return get_scored_response(_q, query, client)[0]
@@ -0,0 +1,210 @@
+import os
+import re
+import time
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import llmAPI
+from tracing import span
+
+# Concurrent news scoring for many companies under a requests / tokens per minute budget.
+# Short company contexts are packed several to a prompt; companies a packed
+# answer leaves out are retried one by one. The client is pluggable: anything
+# with `async complete(content) -> str`, e.g. GroqClient pointed at a local fake server.
+RPM = int(os.getenv("LLM_RPM", 30))
+TPM = int(os.getenv("LLM_TPM", 6000))
+CONCURRENCY = 8
+RETRIES = 4
+BACKOFF = 1.0          # Seconds, doubled per attempt, with jitter
+PACK_CHARS = 6000      # Packed prompt size limit
+PACK_MAX = 5           # Companies per packed prompt
+RETRIEVE_WORKERS = 4
+
+PACKED_TEMPLATE = """You are a professional financial analyst.
+
+For each company below you get a collection of recent news articles.
+For every company, give a score between -1 and 1, where -1 means "strongly negative" and 1 means "strongly positive".
+Answer with exactly one line per company, in the format "<ID>: Score: X", where <ID> is the company's ID and X is the score.
+
+{companies}
+"""
+PACKED_ENTRY = """[{id}] Company "{company}":
+{news}
+"""
+PACKED_LINE = re.compile(r'\[?(\d+)\]?\s*:\s*\*{0,2}score\*{0,2}\s*:\s*([-+]?\d*\.?\d+)', re.IGNORECASE)
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+class GroqClient:
+    def __init__(self, base_url = None, model = llmAPI.MODEL):
+        from groq import AsyncGroq
+        load_dotenv()
+        self.model = model
+        self.client = AsyncGroq(
+            api_key = os.getenv("GROQ_API_KEY"),
+            base_url = base_url or os.getenv("GROQ_BASE_URL"),
+        )
+
+    async def complete(self, content):
+        chat_completion = await self.client.chat.completions.create(
+            messages = [{"role": "user", "content": content}],
+            model = self.model,
+        )
+        return chat_completion.choices[0].message.content
+
+
+class RateLimiter:
+    '''
+    Sliding one-minute window over requests and (estimated) tokens
+    '''
+    def __init__(self, rpm = RPM, tpm = TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.sent = []  # (time, tokens)
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens):
+        tokens = min(tokens, self.tpm)  # A prompt larger than the budget still goes out alone
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.sent = [(t, n) for t, n in self.sent if now - t < 60]
+                if len(self.sent) < self.rpm and sum(n for _, n in self.sent) + tokens <= self.tpm:
+                    self.sent.append((now, tokens))
+                    return
+                await asyncio.sleep(60 - (now - self.sent[0][0]) + 0.01)
+
+
+async def _call(client, limiter, semaphore, content):
+    for attempt in range(RETRIES):
+        try:
+            async with semaphore:
+                await limiter.acquire(estimate_tokens(content))
+                with span("llm.call", bytes = len(content), attempt = attempt):
+                    return await client.complete(content)
+        except Exception as e:
+            if attempt == RETRIES - 1:
+                raise
+            print(f"LLM call failed ({e}), retrying")
+            await asyncio.sleep(BACKOFF * (2 ** attempt) * (1 + random.random()))
+
+
+def _pack(jobs):
+    '''
+    Group jobs into packed prompts of at most PACK_MAX companies / PACK_CHARS characters
+    '''
+    groups, current, size = [], [], 0
+    for job in jobs:
+        entry = len(job["entry"])
+        if current and (len(current) >= PACK_MAX or size + entry > PACK_CHARS):
+            groups.append(current)
+            current, size = [], 0
+        current.append(job)
+        size += entry
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def _score_single(client, limiter, semaphore, job):
+    text = await _call(client, limiter, semaphore, job["content"])
+    score = llmAPI.parse_score(text)
+    if score is not None:
+        llmAPI.cache_put(job["key"], text, score)
+    return {"score": score, "text": text, "error": None if score is not None else "No score in answer"}
+
+
+async def _score_group(client, limiter, semaphore, group):
+    if len(group) == 1:
+        job = group[0]
+        return {job["company"]: await _score_single(client, limiter, semaphore, job)}
+
+    entries = "\n".join(PACKED_ENTRY.format(id = i, company = job["company"], news = job["news"]) for i, job in enumerate(group))
+    results = {}
+    try:
+        text = await _call(client, limiter, semaphore, PACKED_TEMPLATE.format(companies = entries))
+        for match in PACKED_LINE.finditer(text):
+            i = int(match.group(1))
+            if 0 <= i < len(group):
+                results[group[i]["company"]] = {"score": float(match.group(2)), "text": match.group(0), "error": None}
+    except Exception as e:
+        print(f"Packed call for {len(group)} companies failed: {e}")
+
+    # Partial answers: the companies left out get their own prompt
+    retry = [job for job in group if job["company"] not in results]
+    for job, result in zip(retry, await asyncio.gather(
+        *(_score_single(client, limiter, semaphore, job) for job in retry), return_exceptions = True
+    )):
+        results[job["company"]] = result if not isinstance(result, Exception) else \
+            {"score": None, "text": None, "error": f"{type(result).__name__}: {result}"}
+    return results
+
+
+async def score_contexts(jobs, client = None, rpm = RPM, tpm = TPM, concurrency = CONCURRENCY, pack = True):
+    '''
+    Score prepared jobs concurrently, returns {company: {"score", "text", "error"}}
+    '''
+    client = client or GroqClient()
+    limiter = RateLimiter(rpm, tpm)
+    semaphore = asyncio.Semaphore(concurrency)
+    groups = _pack(jobs) if pack else [[job] for job in jobs]
+    results = {}
+    for group_result in await asyncio.gather(
+        *(_score_group(client, limiter, semaphore, g) for g in groups), return_exceptions = True
+    ):
+        if isinstance(group_result, Exception):
+            print(f"Group failed: {group_result}")
+            continue
+        results.update(group_result)
+    for job in jobs:
+        results.setdefault(job["company"], {"score": None, "text": None, "error": "Scoring failed"})
+    return results
+
+
+def _prepare(company):
+    # Same retrieval, prompt and cache key as the app's outlook question
+    query = f"{llmAPI.OUTLOOK_QUERY} {company}?"
+    relevant_news = llmAPI.retrieve(company, query, k = 5)
+    content, key = llmAPI.outlook_prompt(company, query, relevant_news)
+    news = "\n".join(f"- {chunk}" for chunk in relevant_news)
+    return {
+        "company": company,
+        "content": content,
+        "key": key,
+        "news": news,
+        "entry": PACKED_ENTRY.format(id = 0, company = company, news = news),
+    }
+
+
+def score_news(companies, client = None, **kwargs):
+    '''
+    News score for every company, {company: {"score", "text", "error"}}
+    Cached answers are reused, only the misses reach the LLM
+    '''
+    companies = list(dict.fromkeys(companies))
+    results, jobs = {}, []
+
+    def prepare(company):
+        try:
+            return _prepare(company)
+        except Exception as e:
+            results[company] = {"score": None, "text": None, "error": f"{type(e).__name__}: {e}"}
+
+    with ThreadPoolExecutor(max_workers = RETRIEVE_WORKERS) as pool:
+        for job in pool.map(prepare, companies):
+            if job is None:
+                continue
+            row = llmAPI.cache_get(job["key"], scored = True)
+            if row is not None:
+                results[job["company"]] = {"score": row[1], "text": row[0], "error": None}
+            else:
+                jobs.append(job)
+
+    print(f"{len(results)} companies cached or failed, {len(jobs)} to score")
+    if jobs:
+        results.update(asyncio.run(score_contexts(jobs, client, **kwargs)))
+    return results
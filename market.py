@@ -0,0 +1,73 @@
+import os
+import json
+import threading
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import yfinance as yf
+from tracing import span
+
+# Market-wide reference values shared by every ticker and every user:
+# Rf (^TNX), Rm (10y annualised ^GSPC return) and the ^VIX close.
+# Computed once per US trading day and persisted so restarts reuse them.
+CACHE_PATH = os.path.join(".", "cache", "market_reference.json")
+
+_lock = threading.Lock()
+_reference = None
+
+
+def _trading_day():
+    return datetime.now(ZoneInfo("America/New_York")).date().isoformat()
+
+
+def _fetch():
+    tnx = yf.Ticker("^TNX")
+    Rf = tnx.info['regularMarketPrice'] / 100
+
+    sp500 = yf.Ticker("^GSPC")  # S&P 500 index
+    hist = sp500.history(period="10y")
+    start_price = hist['Close'].iloc[0]
+    end_price = hist['Close'].iloc[-1]
+    Rm = ((end_price / start_price) ** (1 / 10)) - 1
+
+    # CBOE Volatility Index (^VIX)
+    vix = yf.Ticker("^VIX").history(period="1d")
+    vix_value = vix['Close'].iloc[-1] if not vix.empty else 0
+
+    return {"rf": float(Rf), "rm": float(Rm), "vix": float(vix_value)}
+
+
+def get_market_reference(path = CACHE_PATH):
+    '''
+    Return {"date", "rf", "rm", "vix"} for the current trading day
+    Memory first, then disk, then the network
+    '''
+    with span("market.reference") as s:
+        return _get_market_reference(path, s)
+
+
+def _get_market_reference(path, s):
+    global _reference
+    today = _trading_day()
+    with _lock:
+        if _reference is not None and _reference["date"] == today:
+            s.set(cache = "hit", source = "memory")
+            return _reference
+
+        try:
+            with open(path, "r", encoding = "utf-8") as f:
+                cached = json.load(f)
+            if cached.get("date") == today:
+                _reference = cached
+                s.set(cache = "hit", source = "disk")
+                return _reference
+        except (OSError, ValueError):
+            pass
+
+        s.set(cache = "miss")
+        _reference = {"date": today, **_fetch()}
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding = "utf-8") as f:
+            json.dump(_reference, f)
+        os.replace(tmp, path)
+        return _reference
@@ -1,11 +1,20 @@
 from newsapi import NewsApiClient
 from dotenv import load_dotenv
 import os
-import re
 from datetime import datetime
 from newspaper import Article
 import time
 import json
+import threading
+import hashlib
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import catalog
+import dedup
+from fetch import host_slot, retry
+from tracing import span, record, bind
 from investopedia import get_investopedia_news
 
 def get_all_news(query):
@@ -21,21 +30,103 @@ def get_all_news(query):
 )
 # ----------------------------------------------  
 
+DOWNLOAD_WORKERS = 16
+DOMAIN_LIMIT = 4       # Concurrent downloads per domain
+DOMAIN_INTERVAL = 0.2  # Seconds between requests to the same domain
+TIMEOUT = 10
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+# One pooled session for every article download
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections = 32, pool_maxsize = DOWNLOAD_WORKERS))
+session.mount("http://", HTTPAdapter(pool_connections = 32, pool_maxsize = DOWNLOAD_WORKERS))
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def get_parse_pool():
+    # HTML parsing is CPU-bound, keep it off the download threads
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers = os.cpu_count())
+        return _parse_pool
+
+def _get(url):
+    resp = session.get(url, headers = HEADERS, timeout = TIMEOUT)
+    # Throttling and server errors are transient, raised inside retry() to be retried
+    if resp.status_code == 429 or resp.status_code >= 500:
+        resp.raise_for_status()
+    return resp
+
+def download(url):
+    host = urlparse(url).netloc
+    with span("news.download", host = host) as s:
+        with host_slot(host, DOMAIN_LIMIT, DOMAIN_INTERVAL):
+            resp = retry(lambda: _get(url))
+        s.set(bytes = len(resp.content), status = resp.status_code)
+    resp.raise_for_status()  # Other 4xx, not worth retrying
+    return resp.text
+
+def parse(url, html):
+    art = Article(url)
+    art.download(input_html = html)
+    art.parse()
+    if art.authors == []:
+        return None
+    return {
+        "title": art.title,
+        "authors": art.authors,
+        "text": art.text,
+        "publish_date": art.publish_date.isoformat() if art.publish_date else None,
+        "source_url": art.source_url if hasattr(art, 'source_url') else None,
+        "url": art.url if hasattr(art, 'url') else None,
+    }
+
+def _timed_parse(url, html):
+    # Runs in the parse pool, the parent records the span
+    start = time.perf_counter()
+    result = parse(url, html)
+    return time.perf_counter() - start, result
+
+def fetch_articles(urls):
+    '''
+    Download concurrently, parse in a process pool,
+    yield each parsed article as soon as it is ready
+    '''
+    procs = get_parse_pool()
+    with ThreadPoolExecutor(max_workers = DOWNLOAD_WORKERS) as threads:
+        pending = {threads.submit(bind(download), url): ("download", url) for url in urls}
+        while pending:
+            done, _ = wait(pending, return_when = FIRST_COMPLETED)
+            for fut in done:
+                stage, url = pending.pop(fut)
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    print(f"Failed to process {url}: {e}")
+                    continue
+                if stage == "download":
+                    print(f"Processing: {url}")
+                    pending[procs.submit(_timed_parse, url, result)] = ("parse", url)
+                    continue
+                elapsed, result = result
+                record("news.parse", elapsed, host = urlparse(url).netloc, parsed = result is not None)
+                if result is not None:
+                    yield result
+
 # Function to save articles to a JSON file and return file name
 def articles_dump(_q):
-    # Check dump directory for recent files, vaild: 24 hrs
-    now = int(time.time() * (10 ** 3))
-    cutoff = now - 24*3600*1000  # 24 hours in ms
-    pattern = re.compile(rf"^{re.escape(_q)}_(\d+)\.jsonl$")
-    recent_files = []
-
-    for fname in os.listdir("dump"):
-        match = pattern.match(fname)
-        if match:
-            timestamp = int(match.group(1))
-            if timestamp >= cutoff:
-                return "./dump/" + fname
+    with catalog.company_lock(_q), span("news.dump", query = _q) as s:
+        return _articles_dump(_q, s)
 
+def _articles_dump(_q, s):
+    # Check the catalog for a recent dump, vaild: 24 hrs
+    entry = catalog.lookup(_q)
+    if entry is not None:
+        s.set(cache = "hit")
+        return entry["path"]
+    s.set(cache = "miss")
 
     load_dotenv()
     news_api_key = os.getenv("NEWSAPI_KEY")
@@ -44,27 +135,11 @@ def articles_dump(_q):
 
     allNews = get_all_news(_q)
 
-    results = []
     urls = get_investopedia_news(_q)
 
     for article in allNews['articles']:
         urls.append(article['url'])
 
-    for url in urls:
-        print(f"Processing: {url}")
-        try:
-            art = Article(url)
-            art.download()
-            art.parse()
-            if art.authors == []:
-                continue
-            results.append(art)
-
-        except Exception as e:
-            print(f"Failed to process {url}: {e}")
-
-        time.sleep(0.2)
-
     SAVE_PATH = os.path.join(".", "dump")
     fname = _q
     
@@ -72,21 +147,41 @@ def articles_dump(_q):
     os.makedirs(SAVE_PATH, exist_ok = True)
     path = os.path.join(SAVE_PATH, filename)
 
-    with open(path, "w", encoding = "utf-8") as f:
-        for article in results:
+    # Articles already in the company's index, or repeated under another URL, are not fetched again.
+    # Without an index there is nothing to deduplicate against. This dump's articles stay
+    # pending until NLP commits them with the index, earlier dumps that never got there are dropped
+    deduper = dedup.Deduper(catalog.normalise(_q), dump = path)
+    if not catalog.has_index(_q):
+        deduper.reset()
+    else:
+        deduper.discard_pending()
+    total = len(urls)
+    urls = deduper.new_urls(urls)
+
+    # Written under a temporary name, so a partial dump is never picked up as fresh
+    count = duplicates = 0
+    content_hash = hashlib.sha256()
+    with open(path + ".part", "w", encoding = "utf-8") as f:
+        for json_obj in fetch_articles(urls):
+            # Near-duplicates (syndicated wire stories, reposts) never reach chunking and the encoder
+            original = deduper.add(json_obj["url"] or "", json_obj["text"] or "")
+            if original is not None:
+                duplicates += 1
+                print(f"Skipping near-duplicate of {original}: {json_obj['url']}")
+                continue
             try:
-                json_obj = {
-                    "title": article.title,
-                    "authors": article.authors,
-                    "text": article.text,
-                    "publish_date": article.publish_date.isoformat() if article.publish_date else None,
-                    "source_url": article.source_url if hasattr(article, 'source_url') else None,
-                    "url": article.url if hasattr(article, 'url') else None,
-                }
-                json.dump(json_obj, f, ensure_ascii = False)
-                f.write("\n")
+                line = json.dumps(json_obj, ensure_ascii = False) + "\n"
+                f.write(line)
+                content_hash.update(line.encode("utf-8"))
+                count += 1
             except Exception as e:
                 print(f"Skipping article due to error: {e}")
+    os.replace(path + ".part", path)
+
+    catalog.record_dump(_q, path, count, content_hash.hexdigest())
+    catalog.evict()
+    dedup.evict()
 
-    print(f"Saved {len(results)} articles to {path}")
+    s.set(n = count, duplicates = duplicates, known_urls = total - len(urls))
+    print(f"Saved {count} articles to {path}, skipped {total - len(urls)} known URLs and {duplicates} near-duplicates")
     return path
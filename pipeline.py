@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from tracing import span, bind
+
+# Small DAG executor for one request. A stage starts as soon as the stages it
+# depends on are done, so independent stages (yfinance info, sector multiples,
+# news + LLM) overlap and the request takes as long as its slowest path.
+WORKERS = 8
+
+
+def _stage(name, fn, kwargs):
+    with span(f"stage.{name}"):
+        return fn(**kwargs)
+
+
+def run(stages, workers = WORKERS, poll = None):
+    '''
+    stages: {name: (fn, [dependency names])}, fn gets the results of its
+    dependencies as keyword arguments
+    Yields (name, result, error) in completion order; a failed stage's
+    dependents are not run and yield the same error
+    poll: seconds, when set (None, None, None) is yielded whenever no stage
+    finished for that long, so the caller can show a stage's progress
+    '''
+    for name, (_, deps) in stages.items():
+        for dep in deps:
+            if dep not in stages:
+                raise KeyError(f"Stage {name} depends on unknown stage {dep}")
+
+    pending = dict(stages)
+    running = {}  # Future -> stage name
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "stage") as pool:
+        while pending or running:
+            progress = False
+            for name, (fn, deps) in list(pending.items()):
+                failed = next((d for d in deps if d in errors), None)
+                if failed is not None:
+                    del pending[name]
+                    errors[name] = errors[failed]
+                    progress = True
+                    yield name, None, errors[name]
+                elif all(d in results for d in deps):
+                    del pending[name]
+                    running[pool.submit(bind(_stage), name, fn, {d: results[d] for d in deps})] = name
+                    progress = True
+
+            if not running:
+                if pending and not progress:
+                    raise ValueError(f"Stage dependency cycle among {sorted(pending)}")
+                continue
+
+            done, _ = wait(running, timeout = poll, return_when = FIRST_COMPLETED)
+            if not done:
+                yield None, None, None
+                continue
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    errors[name] = e
+                    yield name, None, e
+                    continue
+                yield name, results[name], None
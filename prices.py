@@ -0,0 +1,228 @@
+import os
+import re
+import time
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import yfinance as yf
+from tracing import span
+
+# Local OHLCV store: one Parquet file per symbol and interval.
+# Only bars after the last stored timestamp are downloaded, and a symbol
+# refreshed less than REFRESH seconds ago is served straight from disk.
+# Each file records in its metadata the earliest time its downloads covered;
+# a request reaching further back refetches the symbol over the wider period.
+STORE_DIR = os.path.join(".", "cache", "ohlcv")
+COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+REFRESH = {"1h": 15 * 60, "1d": 6 * 3600}  # Seconds, by interval
+DEFAULT_REFRESH = 15 * 60
+BULK_SIZE = 200  # Symbols per yf.download call
+PERIOD = re.compile(r"(\d+)(d|wk|mo|y)")
+PERIOD_DAYS = {"d": 1, "wk": 5, "mo": 21, "y": 252}  # Trading days per period unit
+CALENDAR_DAYS = {"d": 7 / 5, "wk": 7, "mo": 31, "y": 366}  # Calendar days spanned per period unit
+MAX_START = pd.Timestamp("1900-01-01", tz = "UTC")  # Coverage of period "max"
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _path(symbol, interval):
+    return os.path.join(STORE_DIR, interval, re.sub(r"[^\w.^-]+", "_", symbol) + ".parquet")
+
+
+def _lock(symbol, interval):
+    with _locks_guard:
+        return _locks.setdefault((symbol, interval), threading.Lock())
+
+
+def _index_name(interval):
+    # Same naming as Ticker.history: Datetime for intraday, Date otherwise
+    return "Datetime" if interval[-1] in "mh" else "Date"
+
+
+def load(symbol, interval = "1h"):
+    path = _path(symbol, interval)
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path)
+
+
+def covered_from(symbol, interval = "1h"):
+    '''
+    Earliest time (UTC) the stored downloads covered, None without a file;
+    the first bar for files written before coverage was recorded
+    '''
+    path = _path(symbol, interval)
+    if not os.path.exists(path):
+        return None
+    value = (pq.read_schema(path).metadata or {}).get(b"covered_from")
+    if value is not None:
+        return pd.Timestamp(value.decode())
+    df = load(symbol, interval)
+    if df.empty:
+        return None
+    first = df.index[0]
+    return first.tz_convert("UTC") if first.tzinfo else first.tz_localize("UTC")
+
+
+def period_start(period, now = None):
+    '''
+    Earliest time (UTC) a download over `period` reaches back to
+    '''
+    check_period(period)
+    now = now or pd.Timestamp.now(tz = "UTC")
+    if period == "max":
+        return MAX_START
+    if period == "ytd":
+        return now.normalize().replace(month = 1, day = 1)
+    n, unit = PERIOD.fullmatch(period).groups()
+    return (now - pd.Timedelta(days = CALENDAR_DAYS[unit] * int(n))).normalize()
+
+
+def _save(symbol, interval, df, covered):
+    path = _path(symbol, interval)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    table = pa.Table.from_pandas(df)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"covered_from": covered.isoformat().encode()})
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def is_fresh(symbol, interval = "1h"):
+    path = _path(symbol, interval)
+    return os.path.exists(path) and time.time() - os.path.getmtime(path) < REFRESH.get(interval, DEFAULT_REFRESH)
+
+
+def _download(symbols, interval, **kwargs):
+    '''
+    One bulk yf.download for many symbols, split back into {symbol: OHLCV frame}
+    '''
+    with span("yfinance.download", n = len(symbols), interval = interval):
+        data = yf.download(
+            symbols, interval = interval, group_by = "ticker", auto_adjust = True,
+            threads = True, progress = False, **kwargs,
+        )
+    frames = {}
+    for symbol in symbols:
+        if isinstance(data.columns, pd.MultiIndex):
+            if symbol not in data.columns.get_level_values(0):
+                continue
+            df = data[symbol]
+        else:
+            df = data
+        df = df[[c for c in COLUMNS if c in df.columns]].dropna(subset = ["Close"])
+        df.index.name = _index_name(interval)
+        frames[symbol] = df
+    return frames
+
+
+def _covers(symbol, interval, start):
+    covered = covered_from(symbol, interval)
+    return covered is not None and covered <= start
+
+
+def update(symbols, period = "5d", interval = "1h", force = False):
+    '''
+    Bring the store up to date for every symbol with as few downloads as possible:
+    new symbols, and known ones not covering `period`, in bulk over `period`;
+    the others in bulk from their oldest last bar
+    '''
+    start = period_start(period)
+    covering = {s: _covers(s, interval, start) for s in dict.fromkeys(symbols)}
+    symbols = [s for s, ok in covering.items() if force or not ok or not is_fresh(s, interval)]
+    cached = {s: load(s, interval) for s in symbols}
+    missing = [s for s, df in cached.items() if df is None or df.empty or not covering[s]]
+    known = [s for s in symbols if s not in missing]
+    covered = {s: start if s in missing else covered_from(s, interval) for s in symbols}
+
+    batches = [(missing[i:i + BULK_SIZE], {"period": period}) for i in range(0, len(missing), BULK_SIZE)]
+    for i in range(0, len(known), BULK_SIZE):
+        batch = known[i:i + BULK_SIZE]
+        last = min(cached[s].index[-1] for s in batch)
+        batches.append((batch, {"start": last.tz_convert("UTC").tz_localize(None) if last.tzinfo else last}))
+
+    for batch, kwargs in batches:
+        try:
+            frames = _download(batch, interval, **kwargs)
+        except Exception as e:
+            print(f"Failed to download {len(batch)} symbols: {e}")
+            continue
+        for symbol in batch:
+            new = frames.get(symbol)
+            with _lock(symbol, interval):
+                old = cached.get(symbol)
+                stored = covered_from(symbol, interval) if old is not None else None
+                if stored is not None:
+                    covered[symbol] = min(covered[symbol], stored)
+                if new is None or new.empty:
+                    if old is not None and covered[symbol] == stored:
+                        os.utime(_path(symbol, interval))  # Nothing new, still checked
+                    elif old is not None:
+                        _save(symbol, interval, old, covered[symbol])  # No older bars exist, the period is covered
+                    continue
+                if old is not None and not old.empty:
+                    # The last stored bar may have been partial, the new download wins
+                    new = pd.concat([old, new])
+                    new = new[~new.index.duplicated(keep = "last")].sort_index()
+                _save(symbol, interval, new, covered[symbol])
+
+
+def check_period(period):
+    '''
+    Reject a period _window cannot cut, before anything is downloaded for it
+    '''
+    if period in ("max", "ytd") or PERIOD.fullmatch(period or ""):
+        return period
+    raise ValueError(f"Unsupported period '{period}', expected max, ytd or a number followed by d, wk, mo or y")
+
+
+def _window(df, period):
+    '''
+    Keep the bars covered by a yfinance-style period, e.g. 5d = last 5 trading days
+    '''
+    check_period(period)
+    if period == "max" or df.empty:
+        return df
+    dates = df.index.normalize()
+    if period == "ytd":
+        return df[dates.year == dates[-1].year]
+    n, unit = PERIOD.fullmatch(period).groups()
+    days = PERIOD_DAYS[unit] * int(n)
+    keep = dates.unique()[-days:]
+    return df[dates.isin(keep)]
+
+
+def get_history(symbol, period = "5d", interval = "1h"):
+    '''
+    Drop-in for Ticker(symbol).history(period, interval), served from disk
+    '''
+    check_period(period)
+    with span("prices.history", symbol = symbol, interval = interval) as s:
+        fresh = is_fresh(symbol, interval) and _covers(symbol, interval, period_start(period))
+        s.set(cache = "hit" if fresh else "miss")
+        if not fresh:
+            update([symbol], period, interval)
+        df = load(symbol, interval)
+    if df is None:
+        return pd.DataFrame(columns = COLUMNS, index = pd.DatetimeIndex([], name = _index_name(interval)))
+    return _window(df, period)
+
+
+def get_panel(symbols, period = "5d", interval = "1h"):
+    '''
+    Aligned Close prices as a (symbols x bar times) frame, NaN where a symbol
+    has no bar, bar times in UTC
+    '''
+    check_period(period)
+    update(symbols, period, interval)
+    closes = {}
+    for symbol in dict.fromkeys(symbols):
+        df = load(symbol, interval)
+        if df is None or df.empty:
+            continue
+        close = _window(df, period)["Close"]
+        if close.index.tz is not None:
+            close.index = close.index.tz_convert("UTC")
+        closes[symbol] = close
+    return pd.DataFrame(closes).sort_index().T
@@ -1,18 +1,71 @@
+import re
 import random
-import yfinance as yf
+import threading
 import pandas as pd
+from market import get_market_reference
+from sector_store import get_multiples
+from tracing import span
 
-# CBOE Volatility Index (^VIX)
-vix = yf.Ticker("^VIX").history(period="1d")
-vix_value = vix['Close'].iloc[-1] if not vix.empty else 0
+SNP500_PATH = 'src/snp500.csv'
 
-weights = {
-    "fin": 0.45,
-    "news": 0.35,
-    "index": 0.2,
-    "random": 0.15 if vix_value > 30 else 0.1 if vix_value > 20 else 0.05
-}
-ttl = sum(weights.values())
+BASE_WEIGHTS = {"fin": 0.45, "news": 0.35, "index": 0.2}
+BUY_THRESHOLD = 0.3
+SELL_THRESHOLD = -0.3
+# The "Score: X" line the LLM is asked to end its news answer with
+SCORE_PATTERN = re.compile(r'\*{0,2}score\*{0,2}\s*:\s*([-+]?\d*\.?\d+)', re.IGNORECASE)
+
+def get_weights(vix_value, base = None):
+    '''
+    Subscore weights normalised to sum to 1
+    The chaos (random) weight grows with the CBOE Volatility Index (^VIX)
+    base: fin / news / index weights before normalisation, BASE_WEIGHTS by default
+    '''
+    weights = dict(base or BASE_WEIGHTS)
+    weights["random"] = 0.15 if vix_value > 30 else 0.1 if vix_value > 20 else 0.05
+    ttl = sum(weights.values())
+    return {key: w / ttl for key, w in weights.items()}
+
+
+class ScoringContext:
+    '''
+    Read-only inputs shared by every scoring request, loaded on first use
+    so importing this module does no file or network I/O
+    '''
+    def __init__(self, sectors_path = SNP500_PATH):
+        self.sectors_path = sectors_path
+        self._sectors = None
+        self._lock = threading.Lock()
+
+    @property
+    def sectors(self):
+        # Financial scores: GICS sectors of the S&P 500
+        if self._sectors is None:
+            with self._lock:
+                if self._sectors is None:
+                    self._sectors = pd.read_csv(self.sectors_path)
+        return self._sectors
+
+    @property
+    def vix(self):
+        # Cached once per trading day by market.py
+        return get_market_reference()["vix"]
+
+    @property
+    def weights(self):
+        # A fresh dict per call, callers cannot alter shared state
+        return get_weights(self.vix)
+
+
+_context = None
+_context_lock = threading.Lock()
+
+def get_context():
+    global _context
+    if _context is None:
+        with _context_lock:
+            if _context is None:
+                _context = ScoringContext()
+    return _context
 
 def capm(dat):
     '''
@@ -21,16 +74,13 @@ def capm(dat):
     rf: Risk-free rate (e.g., yield on 10-year Treasury bond)
     rm: Expected return of the market
     '''
-    tnx = yf.Ticker("^TNX")
-    Rf = tnx.info['regularMarketPrice'] / 100
-
-    sp500 = yf.Ticker("^GSPC")  # S&P 500 index
-    hist = sp500.history(period="10y")
-    start_price = hist['Close'].iloc[0]
-    end_price = hist['Close'].iloc[-1]
-    Rm = ((end_price / start_price) ** (1 / 10)) - 1
+    # Rf from ^TNX, Rm from 10y of ^GSPC, computed once per trading day
+    with span("score.capm"):
+        market = get_market_reference()
+        Rf = market["rf"]
+        Rm = market["rm"]
 
-    Ri = Rf + dat.info['beta'] * (Rm - Rf)
+        Ri = Rf + dat.info['beta'] * (Rm - Rf)
     return Ri
 
 def wacc(dat, Ri):
@@ -59,39 +109,14 @@ def capm_wacc_score(capm, wacc):
     return score
 
 # Financial scores: EV/EBITDA, P/E, P/B
-df = pd.read_csv('src/snp500.csv')
-
 def get_financial_scores(symbol):
-    dat = yf.Ticker(symbol)
-    enterprise_value = dat.info['enterpriseValue']
-    ebidta = dat.info['ebitda']
-    ev_ebitda = enterprise_value / ebidta
-    pe_ratio = dat.info["trailingPE"]
-    pb_ratio = dat.info["priceToBook"]
-
-    sector = df[df['Symbol'] == symbol]['GICS Sector'].values[0] if not df[df['Symbol'] == symbol].empty else "Unknown"
-
-    competitors = df[df['GICS Sector'] == sector]['Symbol'].tolist()
-    competitors.remove(symbol)  # Remove the current symbol from its competitors
-
-    avg = {
-        "ev_ebitda": 0.0,
-        "pe_ratio": 0.0,
-        "pb_ratio": 0.0
-    }
-    for i in competitors:
-        dat_comp = yf.Ticker(i)
-        try:
-            avg["ev_ebitda"] += dat_comp.info['enterpriseValue'] / dat_comp.info['ebitda']
-            avg["pe_ratio"] += dat_comp.info['trailingPE']
-            avg["pb_ratio"] += dat_comp.info['priceToBook']
-        except KeyError:
-            print(f"Financial data for {i} is not available")
-            
-    for key in avg:
-        if len(competitors) > 0:
-            avg[key] /= len(competitors)
-        
+    # Own multiples and sector averages come from the on-disk store,
+    # only an expired sector is refetched (concurrently) from yfinance
+    with span("score.financial", symbol = symbol):
+        own, avg, sector = get_multiples(symbol, get_context().sectors)
+    ev_ebitda = own["ev_ebitda"]
+    pe_ratio = own["pe_ratio"]
+    pb_ratio = own["pb_ratio"]
 
     ev_ebitda_score = avg['ev_ebitda'] / ev_ebitda 
     pe_ratio_score = avg['pe_ratio'] / pe_ratio
@@ -104,12 +129,37 @@ def get_financial_scores(symbol):
 
 
 
-def get_final_score(subscores):
+def get_final_score(subscores, weights = None):
+    '''
+    Weighted sum of the subscores, does not mutate the weights
+    '''
+    if weights is None:
+        weights = get_context().weights
     score = 0.0
     for key in weights:
-        weights[key] /= ttl
+        if subscores[key] is None:
+            raise ValueError(f"No {key} score, e.g. an answer without a Score: line")
         score += weights[key] * subscores[key]
     return score
 
-
-# PoC: prediction on 5 days later
\ No newline at end of file
+def parse_score(text, complete = True):
+    '''
+    The "Score: X" value of an answer, None when there is none
+    complete = False for an answer still streaming: a number at its very end may not be whole yet
+    '''
+    match = SCORE_PATTERN.search(text or "")
+    if match is None:
+        return None
+    if not complete and not re.search(r"[^\d.]", text[match.end():]):
+        return None
+    return float(match.group(1))
+
+def get_decision(final_score, buy = BUY_THRESHOLD, sell = SELL_THRESHOLD):
+    if final_score > buy:
+        return "BUY"
+    elif final_score < sell:
+        return "SELL"
+    return "HOLD"
+
+
+# PoC: prediction on 5 days later
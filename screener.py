@@ -0,0 +1,192 @@
+import os
+import json
+import argparse
+import multiprocessing
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import yfinance as yf
+import sector_store
+from market import get_market_reference
+from prices import get_panel
+from symbol_list import load_symbols
+from search_index import clean_company_name
+from llm_batch import score_news
+from linear_regression_model import trend_scores
+from score import capm, wacc, capm_wacc_score, get_financial_scores, get_final_score, get_decision, get_context
+
+# Headless batch screening over the whole symbol universe.
+# Library: run(symbols) / CLI: python screener.py [--workers N] [--network N] [--limit N] [--resume]
+CHECKPOINT_PATH = os.path.join(".", "cache", "screener_checkpoint.jsonl")
+OUTPUT_PATH = os.path.join(".", "screener.parquet")
+WORKERS = os.cpu_count()
+NETWORK_BUDGET = 8  # yfinance calls in flight across all worker processes
+NEUTRAL_MULTIPLE = 1.0  # Score of a missing multiple: the sector average over itself
+
+_budget = None
+
+
+def _init_worker(budget):
+    global _budget
+    _budget = budget
+
+
+def score_symbol(symbol, index_score, price, news_score = 0.0):
+    '''
+    Score one symbol the same way the app does, without chaos (no user slider, 0)
+    index_score and price come from the vectorized trend pass over the panel,
+    news_score from the batched LLM stage, 0 when it was not run
+    '''
+    dat = yf.Ticker(symbol)
+    with _budget:
+        dat.info  # Fetched once, cached on the Ticker for capm and wacc
+        dat.financials
+
+    Ri = capm(dat)
+    W = wacc(dat, Ri)
+    try:
+        financial_scores = get_financial_scores(symbol)  # From the warm sector store
+    except KeyError:
+        # Outside the S&P 500 sectors or no multiples: reported as missing, neutral in fin
+        financial_scores = {key: np.nan for key in sector_store.FIELDS}
+    financial_scores["capm_wacc"] = capm_wacc_score(Ri, W)
+    # Multiple scores are sector average / own, so on par with the sector is 1, not 0
+    fin_score = 0.25 * sum(NEUTRAL_MULTIPLE if np.isnan(v) else v for v in financial_scores.values())
+
+    final_score = get_final_score({
+        "fin": fin_score,
+        "news": news_score,
+        "index": index_score,
+        "random": 0.0,
+    })
+    return {
+        "symbol": symbol,
+        "price": float(price),
+        "capm": float(Ri),
+        "wacc": float(W),
+        **{key: float(v) for key, v in financial_scores.items()},
+        "fin": float(fin_score),
+        "index": float(index_score),
+        "news": float(news_score),
+        "final_score": float(final_score),
+        "decision": get_decision(final_score),
+        "error": None,
+    }
+
+
+def get_index_scores(symbols):
+    '''
+    Bulk-download 5d hourly bars into the OHLCV store, then fit every trend at once
+    Returns {symbol: (index score, last price, 5-day prediction)}
+    '''
+    panel = get_panel(symbols, period = "5d", interval = "1h")
+    if panel.empty:
+        return {}
+    hours = (panel.columns - panel.columns[0]).total_seconds().values / 3600.0
+    trends = trend_scores(panel.values, hours)
+    last_price = panel.ffill(axis = 1).iloc[:, -1].values
+    return {
+        symbol: (trends["index_score"][i], last_price[i], trends["prediction"][i])
+        for i, symbol in enumerate(panel.index)
+    }
+
+
+def get_news_scores(symbols):
+    '''
+    {symbol: news score} from one concurrent, rate-limited LLM pass
+    Symbols whose news could not be scored get 0
+    '''
+    names = load_symbols().drop_duplicates('Symbol').set_index('Symbol')['Name']
+    companies = {s: clean_company_name(str(names.get(s, s))) for s in symbols}
+    results = score_news(companies.values())
+    return {s: results.get(c, {}).get("score") or 0.0 for s, c in companies.items()}
+
+
+def _safe_score(symbol, index_score, price, prediction, news_score = 0.0):
+    try:
+        row = score_symbol(symbol, index_score, price, news_score)
+        row["prediction_5d"] = float(prediction)
+        return row
+    except Exception as e:
+        return {"symbol": symbol, "error": f"{type(e).__name__}: {e}"}
+
+
+def load_checkpoint(path = CHECKPOINT_PATH):
+    rows = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding = "utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue  # Torn last line of a crashed run
+                rows[row["symbol"]] = row
+    return rows
+
+
+def run(symbols, workers = WORKERS, network = NETWORK_BUDGET, retry_errors = False,
+        checkpoint = CHECKPOINT_PATH, output = OUTPUT_PATH, news = False, resume = False):
+    '''
+    Score every symbol and write a ranked table
+    resume: continue an interrupted run from its checkpoint; otherwise every
+    symbol is scored afresh. The checkpoint is deleted once the table is written
+    '''
+    if not resume and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = load_checkpoint(checkpoint)
+    todo = [s for s in dict.fromkeys(symbols)
+            if s not in done or (retry_errors and done[s].get("error"))]
+    print(f"{len(done)} symbols in checkpoint, {len(todo)} to score")
+
+    # Shared inputs are fetched once here, not once per worker
+    get_market_reference()
+    sector_store.refresh(get_context().sectors)
+
+    index_scores = get_index_scores(todo)
+    news_scores = get_news_scores([s for s in todo if s in index_scores]) if news else {}
+
+    os.makedirs(os.path.dirname(checkpoint), exist_ok = True)
+    budget = multiprocessing.BoundedSemaphore(network)
+    with open(checkpoint, "a", encoding = "utf-8") as f, \
+            ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (budget,)) as pool:
+        futures = [pool.submit(_safe_score, s, *index_scores[s], news_scores.get(s, 0.0))
+                   for s in todo if s in index_scores]
+        missing = [{"symbol": s, "error": "No price history"} for s in todo if s not in index_scores]
+        results = chain(missing, (fut.result() for fut in as_completed(futures)))
+        for n, row in enumerate(results, 1):
+            done[row["symbol"]] = row
+            f.write(json.dumps(row) + "\n")
+            f.flush()
+            if n % 100 == 0:
+                print(f"Scored {n}/{len(todo)}")
+
+    table = pd.DataFrame([done[s] for s in dict.fromkeys(symbols) if s in done])
+    if "final_score" not in table:
+        table["final_score"] = np.nan  # Every symbol failed
+    table = table.sort_values("final_score", ascending = False, na_position = "last").reset_index(drop = True)
+    table["rank"] = range(1, len(table) + 1)
+    table.to_parquet(output, index = False)
+    print(f"Wrote {len(table)} rows to {output}")
+    # Completed: the next run is a new rescore, not a resume of this one
+    os.remove(checkpoint)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Rank the symbol universe BUY/HOLD/SELL")
+    parser.add_argument("--symbols", nargs = "*", help = "Symbols to score, default: all of src/symbol.csv")
+    parser.add_argument("--limit", type = int, help = "Only the first N symbols")
+    parser.add_argument("--workers", type = int, default = WORKERS)
+    parser.add_argument("--network", type = int, default = NETWORK_BUDGET, help = "Concurrent yfinance calls")
+    parser.add_argument("--resume", action = "store_true", help = "Continue an interrupted run from its checkpoint")
+    parser.add_argument("--retry-errors", action = "store_true", help = "With --resume, rescore the symbols that failed")
+    parser.add_argument("--news", action = "store_true", help = "Score news with the LLM (batched, rate-limited)")
+    parser.add_argument("--output", default = OUTPUT_PATH)
+    args = parser.parse_args()
+
+    symbols = args.symbols or load_symbols()['Symbol'].dropna().astype(str).tolist()
+    if args.limit:
+        symbols = symbols[:args.limit]
+    run(symbols, args.workers, args.network, args.retry_errors, output = args.output, news = args.news,
+        resume = args.resume)
@@ -0,0 +1,99 @@
+import re
+from itertools import chain
+from bisect import bisect_left
+from collections import defaultdict
+
+def clean_company_name(name):
+    # Split at the first occurrence of any of the keywords and keep only the part before
+    parts = re.split(
+        r'\b(Inc\.?|Incorporated|Ltd\.?|Limited|Corp\.?|Corporation|LLC|PLC|S\.A\.|AG|N\.V\.|Co\.?|Common [A-Z]* Stock|Class [A-Z]|Ordinary Shares)\b\.?',
+        name, flags=re.IGNORECASE, maxsplit=1
+    )
+    return parts[0].strip(" ,")
+
+
+class SymbolIndex:
+    '''
+    In-memory search over the symbol list, built once
+    - exact symbol: hash map
+    - symbol prefix: sorted keys + bisect
+    - name words: sorted tokens + bisect, token -> rows postings
+    - substring: 1/2/3-gram postings, candidates verified with `in`
+    Within a tier, symbols and name words come in alphabetical order, substrings in file order
+    '''
+    NGRAM = 3
+
+    def __init__(self, df):
+        self.symbols = df['Symbol'].fillna('').astype(str).tolist()
+        self.names = df['Name'].fillna('').astype(str).tolist()
+        self.labels = [f"{s} - {n}" for s, n in zip(self.symbols, self.names)]
+        self.clean_names = [clean_company_name(n) for n in self.names]
+        self._row = {label: i for i, label in reversed(list(enumerate(self.labels)))}
+
+        self._lower = [f"{s.lower()}\n{n.lower()}" for s, n in zip(self.symbols, self.names)]
+        self._exact = {}
+        for i, s in enumerate(self.symbols):
+            self._exact.setdefault(s.lower(), i)
+        self._sym_keys = sorted((s.lower(), i) for i, s in enumerate(self.symbols))
+
+        postings = defaultdict(set)
+        for i, name in enumerate(self.clean_names):
+            for token in re.findall(r"\w+", name.lower()):
+                postings[token].add(i)
+        self._tokens = sorted(postings)
+        self._token_rows = {t: sorted(rows) for t, rows in postings.items()}
+
+        grams = defaultdict(set)
+        for i, text in enumerate(self._lower):
+            for n in range(1, self.NGRAM + 1):
+                for j in range(len(text) - n + 1):
+                    grams[text[j:j + n]].add(i)
+        self._grams = {g: sorted(rows) for g, rows in grams.items()}
+
+    def _prefix(self, keys, q):
+        # Every key of a sorted list starting with q
+        start = bisect_left(keys, (q,) if isinstance(keys[0], tuple) else q) if keys else 0
+        for k in keys[start:]:
+            key = k[0] if isinstance(k, tuple) else k
+            if not key.startswith(q):
+                break
+            yield k
+
+    def _substring(self, q):
+        # Rows containing q, in row order: walk the shortest posting list of q's n-grams
+        if len(q) <= self.NGRAM:
+            return iter(self._grams.get(q, []))
+        rows = min(
+            (self._grams.get(q[j:j + self.NGRAM], []) for j in range(len(q) - self.NGRAM + 1)),
+            key = len,
+        )
+        return (i for i in rows if q in self._lower[i])
+
+    def search(self, query, limit = 100):
+        '''
+        "Symbol - Name" labels matching query as a case-insensitive substring,
+        ranked: exact symbol, symbol prefix, name word prefix, any substring
+        Stops as soon as `limit` results are found
+        '''
+        q = query.strip().lower()
+        if not q:
+            return self.labels
+        tiers = [
+            [self._exact[q]] if q in self._exact else [],
+            (i for _, i in self._prefix(self._sym_keys, q)),
+            (i for token in self._prefix(self._tokens, q) for i in self._token_rows[token]),
+            self._substring(q) if "\n" not in q else [],
+        ]
+        found = {}  # Insertion ordered, doubles as the seen set
+        for i in chain.from_iterable(tiers):
+            found.setdefault(i)
+            if len(found) >= limit:
+                break
+        return [self.labels[i] for i in found]
+
+    def resolve(self, label):
+        '''
+        (symbol, cleaned company name) for a label returned by search
+        '''
+        i = self._row[label]
+        return self.symbols[i], self.clean_names[i]
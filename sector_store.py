@@ -0,0 +1,180 @@
+# On-disk store of per-ticker multiples (EV/EBITDA, P/E, P/B) and per-sector
+# aggregates, so scoring a symbol is a couple of indexed lookups instead of
+# a network call per sector peer.
+# Precompute / refresh: python sector_store.py [sector ...]
+import os
+import sys
+import time
+import sqlite3
+import threading
+import pandas as pd
+from fetch import get_infos
+from tracing import span
+
+DB_PATH = os.path.join(".", "cache", "sector_multiples.db")
+TTL = 24 * 3600  # Seconds before a ticker's multiples are refetched
+FIELDS = ("ev_ebitda", "pe_ratio", "pb_ratio")
+
+_locks = {}  # sector -> lock held while that sector is refreshed
+_locks_lock = threading.Lock()
+
+
+def _sector_lock(sector):
+    with _locks_lock:
+        return _locks.setdefault(sector, threading.Lock())
+
+
+def connect(path = DB_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    conn = sqlite3.connect(path, timeout = 30)
+    conn.execute("""CREATE TABLE IF NOT EXISTS multiples (
+        symbol TEXT PRIMARY KEY,
+        sector TEXT NOT NULL,
+        ev_ebitda REAL,
+        pe_ratio REAL,
+        pb_ratio REAL,
+        fetched_at REAL NOT NULL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS multiples_sector ON multiples (sector)")
+    # Sums over every member, averages excluding one ticker are then O(1)
+    conn.execute("""CREATE TABLE IF NOT EXISTS sectors (
+        sector TEXT PRIMARY KEY,
+        members INTEGER NOT NULL,
+        ev_ebitda REAL NOT NULL,
+        pe_ratio REAL NOT NULL,
+        pb_ratio REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )""")
+    return conn
+
+
+def _multiples(info):
+    '''
+    Extract the multiples from Ticker.info, None for each missing field
+    '''
+    info = info or {}
+    try:
+        ev_ebitda = info['enterpriseValue'] / info['ebitda']
+    except (KeyError, TypeError, ZeroDivisionError):
+        ev_ebitda = None
+    return {
+        "ev_ebitda": ev_ebitda,
+        "pe_ratio": info.get('trailingPE'),
+        "pb_ratio": info.get('priceToBook'),
+    }
+
+
+def refresh_sector(conn, sector, symbols, ttl = TTL):
+    '''
+    Refetch only the members whose multiples are missing or older than ttl,
+    then recompute the sector aggregate
+    '''
+    now = time.time()
+    fresh = {row[0] for row in conn.execute(
+        "SELECT symbol FROM multiples WHERE sector = ? AND fetched_at >= ?",
+        (sector, now - ttl),
+    )}
+    stale = [s for s in symbols if s not in fresh]
+
+    if stale:
+        infos = get_infos(stale)
+        rows = []
+        for symbol, info in infos.items():
+            if info is None:
+                continue  # Keep the previous values, retry on the next refresh
+            m = _multiples(info)
+            rows.append((symbol, sector, m["ev_ebitda"], m["pe_ratio"], m["pb_ratio"], now))
+        conn.executemany("INSERT OR REPLACE INTO multiples VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    placeholders = ",".join("?" * len(symbols))
+    sums = conn.execute(
+        f"SELECT TOTAL(ev_ebitda), TOTAL(pe_ratio), TOTAL(pb_ratio) FROM multiples "
+        f"WHERE symbol IN ({placeholders})",
+        symbols,
+    ).fetchone()
+    conn.execute(
+        "INSERT OR REPLACE INTO sectors VALUES (?, ?, ?, ?, ?, ?)",
+        (sector, len(symbols), *sums, now),
+    )
+    conn.commit()
+    print(f"Refreshed {sector}: {len(stale)} of {len(symbols)} tickers fetched")
+
+
+def refresh(sectors_df, sectors = None, ttl = TTL, path = DB_PATH):
+    '''
+    Walk every GICS sector of snp500.csv (or only `sectors`) and refresh it
+    '''
+    conn = connect(path)
+    try:
+        for sector, group in sectors_df.groupby('GICS Sector'):
+            if sectors and sector not in sectors:
+                continue
+            with _sector_lock(sector):
+                refresh_sector(conn, sector, group['Symbol'].tolist(), ttl)
+    finally:
+        conn.close()
+
+
+def load_multiples(path = DB_PATH):
+    '''
+    Every stored ticker's multiples as a frame indexed by symbol
+    '''
+    conn = connect(path)
+    try:
+        return pd.read_sql_query(
+            "SELECT symbol, sector, ev_ebitda, pe_ratio, pb_ratio, fetched_at FROM multiples", conn, index_col = "symbol"
+        )
+    finally:
+        conn.close()
+
+
+def _is_stale(conn, sector, ttl):
+    row = conn.execute("SELECT updated_at FROM sectors WHERE sector = ?", (sector,)).fetchone()
+    return row is None or row[0] < time.time() - ttl
+
+
+def get_multiples(symbol, sectors_df, ttl = TTL, path = DB_PATH):
+    '''
+    Return (own multiples, sector averages excluding the symbol, sector)
+    Refreshes the symbol's sector first if it has expired
+    '''
+    match = sectors_df[sectors_df['Symbol'] == symbol]
+    sector = match['GICS Sector'].values[0] if not match.empty else "Unknown"
+    members = sectors_df[sectors_df['GICS Sector'] == sector]['Symbol'].tolist()
+
+    conn = connect(path)
+    try:
+        with span("sector.multiples", sector = sector) as s:
+            stale = _is_stale(conn, sector, ttl)
+            s.set(cache = "miss" if stale else "hit")
+            if stale:
+                # Only callers of this sector wait on its refresh, fresh sectors are read meanwhile;
+                # SQLite serialises the short writes that publish it
+                with _sector_lock(sector):
+                    if _is_stale(conn, sector, ttl):
+                        refresh_sector(conn, sector, members, ttl)
+
+        own = conn.execute(
+            "SELECT ev_ebitda, pe_ratio, pb_ratio FROM multiples WHERE symbol = ?", (symbol,)
+        ).fetchone()
+        agg = conn.execute(
+            "SELECT members, ev_ebitda, pe_ratio, pb_ratio FROM sectors WHERE sector = ?", (sector,)
+        ).fetchone()
+    finally:
+        conn.close()
+
+    if own is None or None in own:
+        raise KeyError(f"Financial data for {symbol} is not available")
+    own = dict(zip(FIELDS, own))
+
+    # Same average as before: the sum over peers divided by the number of peers
+    peers = agg[0] - 1
+    avg = {}
+    for key, total in zip(FIELDS, agg[1:]):
+        total -= own[key]
+        avg[key] = total / peers if peers > 0 else total
+    return own, avg, sector
+
+
+if __name__ == "__main__":
+    refresh(pd.read_csv(os.path.join("src", "snp500.csv")), sectors = sys.argv[1:] or None)
@@ -0,0 +1,365 @@
+import os
+import time
+import json
+import queue
+import asyncio
+import argparse
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import yfinance as yf
+from aiohttp import web
+import pipeline
+from llmAPI import OUTLOOK_QUERY, stream_response
+from NLP import get_model, retrieve
+from prices import get_history, check_period
+from linear_regression_model import fit_trend
+from score import capm, wacc, capm_wacc_score, get_financial_scores, get_final_score, get_decision, get_context, \
+    parse_score
+from tracing import span
+
+# Long-running recommendation service, one process for every Streamlit session.
+# The encoder, the loaded company indexes, the scoring context and the recent
+# results live here once, on top of the on-disk caches (prices, sector
+# multiples, LLM answers), instead of once per Streamlit worker.
+# Blocking work runs in a thread pool; concurrent score requests for the same
+# ticker share one computation.
+#   POST /score    {"symbol", "name", "random"}  -> NDJSON, streamed: {"stage", "result", "error"}
+#                  per stage as it ends, {"delta"} per piece of the news answer, "final" last
+#   GET  /history  ?symbol=&period=5d&interval=1h -> bars, pandas "split" JSON
+#   POST /search   {"company", "query", "k"}     -> {"chunks": [...]}
+#   POST /chat     {"company", "query"}          -> the answer as chunked text, streamed
+#   GET  /health
+#   python service.py [--host 127.0.0.1] [--port 8765] [--workers N]
+HOST = "127.0.0.1"
+PORT = 8765
+WORKERS = int(os.getenv("STOCKREC_SERVICE_WORKERS", 2 * (os.cpu_count() or 4)))
+SCORE_TTL = 15 * 60  # Seconds a ticker's scores are reused, same as the hourly bars' refresh
+SCORE_MAX = 1024     # Tickers kept in the result cache
+STREAM_POLL = 0.05   # Seconds between forwarding the news answer's new pieces
+
+_END = object()
+
+
+class Broadcast:
+    '''
+    Events of one computation, replayed from the start to every subscriber
+    Only touched from the event loop, no lock needed
+    '''
+    def __init__(self):
+        self.events = []
+        self.error = None
+        self.done = False
+        self._changed = asyncio.Condition()
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def feed(self, events):
+        try:
+            async for event in events:
+                self.events.append(event)
+                await self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            await self._notify()
+
+    async def subscribe(self):
+        i = 0
+        while True:
+            while i < len(self.events):
+                yield self.events[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.done or len(self.events) > i)
+
+
+class SingleFlight:
+    '''
+    One computation per key: concurrent callers follow the same event stream
+    '''
+    def __init__(self):
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    def join(self, key, events):
+        '''
+        Broadcast of key's computation, started from events() if none is in flight
+        A client going away does not cancel it, the others still get every event
+        '''
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = Broadcast()
+            task = asyncio.ensure_future(flight.feed(events()))
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        return flight
+
+
+class ResultCache:
+    '''
+    Per-ticker results for SCORE_TTL seconds, oldest dropped first
+    Only touched from the event loop, no lock needed
+    '''
+    def __init__(self, ttl = SCORE_TTL, max_size = SCORE_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = {}
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None or time.time() - item[0] > self.ttl:
+            return None
+        return item[1]
+
+    def put(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = (time.time(), value)
+        while len(self._items) > self.max_size:
+            self._items.pop(next(iter(self._items)))
+
+
+def index_score(symbol):
+    hist = get_history(symbol, period = "5d", interval = "1h").reset_index()
+    model, _ = fit_trend(hist)
+    return float(np.tanh(model.coef_[0] / 2))
+
+
+def compute(symbol, name):
+    '''
+    Every subscore of one ticker that does not depend on the caller, as events in
+    completion order with the app's stage names: {"stage", "result", "error"} once a
+    stage ends, {"delta"} for each piece of the news answer while it streams
+    '''
+    dat = yf.Ticker(symbol)
+    deltas = queue.Queue()
+
+    def news():
+        parts = []
+        for delta in stream_response(_q = name, query = f"{OUTLOOK_QUERY} {name}?"):
+            parts.append(delta)
+            deltas.put(delta)
+        text = "".join(parts)
+        return text, parse_score(text)
+
+    stages = {
+        "index": (lambda: index_score(symbol), []),
+        "capm": (lambda: capm(dat), []),
+        "wacc": (lambda capm: wacc(dat, capm), ["capm"]),
+        "capm_wacc": (lambda capm, wacc: capm_wacc_score(capm, wacc), ["capm", "wacc"]),
+        "multiples": (lambda: get_financial_scores(symbol), []),
+        "news": (news, []),
+    }
+    with span("service.compute", symbol = symbol):
+        for stage, result, error in pipeline.run(stages, poll = STREAM_POLL):
+            # A stage's deltas are all queued before it ends, so they go out first
+            while not deltas.empty():
+                yield {"delta": deltas.get_nowait()}
+            if stage is not None:
+                yield {"stage": stage, "result": result, "error": None if error is None else str(error)}
+
+
+def final_stage(parts, random_score):
+    '''
+    The caller's final score from the shared subscores, chaos is per request
+    '''
+    for dep in ("capm_wacc", "multiples", "news", "index"):
+        if parts[dep][1] is not None:
+            return None, parts[dep][1]
+    fin_score = 0.25 * sum(dict(parts["multiples"][0], capm_wacc = parts["capm_wacc"][0]).values())
+    subscores = {"fin": fin_score, "news": parts["news"][0][1], "index": parts["index"][0], "random": random_score}
+    try:
+        final_score = get_final_score(subscores)
+        return (final_score, get_decision(final_score)), None
+    except Exception as e:
+        # e.g. a news answer without a score, reported like any failed stage
+        return None, e
+
+
+async def _blocking(request, fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(request.app["pool"], partial(fn, *args))
+
+
+async def _iterate(request, gen):
+    '''
+    Drive a blocking generator in the pool, its items as an async generator
+    '''
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def produce():
+        try:
+            for item in gen:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            loop.call_soon_threadsafe(queue.put_nowait, _END)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+
+    loop.run_in_executor(request.app["pool"], produce)
+    while True:
+        item = await queue.get()
+        if item is _END:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+async def _body(request, *required):
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text = "Body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text = "Body must be a JSON object")
+    missing = [key for key in required if not body.get(key)]
+    if missing:
+        raise web.HTTPBadRequest(text = f"Missing {', '.join(missing)}")
+    wrong = [key for key in required if not isinstance(body[key], str)]
+    if wrong:
+        raise web.HTTPBadRequest(text = f"{', '.join(wrong)} must be a string")
+    return body
+
+
+def _number(body, key, default, cast = float):
+    try:
+        return cast(body.get(key, default))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text = f"{key} must be a number")
+
+
+# numpy scalars and NaN multiples pass through as plain floats
+_dumps = partial(json.dumps, default = float)
+
+
+def _json(data, status = 200):
+    return web.json_response(data, status = status, dumps = _dumps)
+
+
+async def handle_score(request):
+    body = await _body(request, "symbol")
+    symbol = body["symbol"].upper()
+    name = str(body.get("name") or symbol)
+    random_score = _number(body, "random", 0.0)
+    key = (symbol, name)
+
+    cache = request.app["results"]
+    cached = cache.get(key)
+
+    async def replay():
+        for stage, (result, error) in cached.items():
+            yield {"stage": stage, "result": result, "error": error}
+
+    async def run():
+        result = {}
+        async for event in _iterate(request, compute(symbol, name)):
+            if "stage" in event:
+                result[event["stage"]] = (event["result"], event["error"])
+            yield event
+        # A failed stage is retried by the next request, not served for SCORE_TTL
+        if all(error is None for _, error in result.values()):
+            cache.put(key, result)
+
+    events = replay() if cached is not None else request.app["flights"].join(key, run).subscribe()
+
+    # One JSON line per event as soon as it is known, the caller's final score last
+    response = web.StreamResponse(headers = {"Content-Type": "application/x-ndjson"})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    parts = {}
+    try:
+        async for event in events:
+            if "stage" in event:
+                parts[event["stage"]] = (event["result"], event["error"])
+            await response.write((_dumps(event) + "\n").encode("utf-8"))
+        result, error = final_stage(parts, random_score)
+        event = {"stage": "final", "result": result, "error": None if error is None else str(error)}
+    except ConnectionResetError:
+        raise  # The client went away, the computation goes on for the others
+    except Exception as e:
+        # The computation itself failed, e.g. the pool is shut down
+        event = {"error": f"{type(e).__name__}: {e}"}
+    await response.write((_dumps(event) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def handle_history(request):
+    symbol = request.query.get("symbol")
+    if not symbol:
+        raise web.HTTPBadRequest(text = "Missing symbol")
+    period = request.query.get("period", "5d")
+    interval = request.query.get("interval", "1h")
+    try:
+        check_period(period)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text = str(e))
+    hist = await _blocking(request, get_history, symbol.upper(), period, interval)
+    bars = hist.reset_index()
+    # As text, so the times keep the exchange's UTC offset
+    bars[bars.columns[0]] = bars[bars.columns[0]].astype(str)
+    return web.Response(text = bars.to_json(orient = "split"), content_type = "application/json")
+
+
+async def handle_search(request):
+    body = await _body(request, "company", "query")
+    chunks = await _blocking(request, retrieve, body["company"], body["query"], _number(body, "k", 5, int))
+    return _json({"chunks": chunks})
+
+
+async def handle_chat(request):
+    body = await _body(request, "company", "query")
+    response = web.StreamResponse(headers = {"Content-Type": "text/plain; charset=utf-8"})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    async for delta in _iterate(request, stream_response(_q = body["company"], query = body["query"])):
+        await response.write(delta.encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def handle_health(request):
+    return _json({"status": "ok", "workers": request.app["workers"], "inflight": len(request.app["flights"])})
+
+
+async def _startup(app):
+    # Load once, before the first request pays for it
+    await asyncio.get_running_loop().run_in_executor(app["pool"], get_model)
+    get_context()
+
+
+async def _cleanup(app):
+    app["pool"].shutdown(wait = False)
+
+
+def create_app(workers = WORKERS):
+    app = web.Application()
+    app["workers"] = workers
+    app["pool"] = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "service")
+    app["flights"] = SingleFlight()
+    app["results"] = ResultCache()
+    app.router.add_post("/score", handle_score)
+    app.router.add_get("/history", handle_history)
+    app.router.add_post("/search", handle_search)
+    app.router.add_post("/chat", handle_chat)
+    app.router.add_get("/health", handle_health)
+    app.on_startup.append(_startup)
+    app.on_cleanup.append(_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Recommendation service shared by every Streamlit session")
+    parser.add_argument("--host", default = HOST)
+    parser.add_argument("--port", type = int, default = PORT)
+    parser.add_argument("--workers", type = int, default = WORKERS)
+    args = parser.parse_args()
+    web.run_app(create_app(args.workers), host = args.host, port = args.port)
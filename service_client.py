@@ -0,0 +1,80 @@
+import io
+import os
+import json
+import pandas as pd
+import requests
+
+# Thin client of service.py for app.py, used when STOCKREC_SERVICE_URL is set,
+# e.g. STOCKREC_SERVICE_URL=http://127.0.0.1:8765 streamlit run app.py
+# Same shapes as the local functions it stands in for, so the app renders both alike.
+SERVICE_URL = os.getenv("STOCKREC_SERVICE_URL")
+ENABLED = bool(SERVICE_URL)
+TIMEOUT = 300  # Seconds, a cold score waits on yfinance, news and the LLM
+
+session = requests.Session()
+
+
+class ServiceError(Exception):
+    pass
+
+
+def _url(path):
+    return SERVICE_URL.rstrip("/") + path
+
+
+def get_history(symbol, period = "5d", interval = "1h"):
+    '''
+    Bars indexed by time, as prices.get_history
+    '''
+    response = session.get(_url("/history"), params = {"symbol": symbol, "period": period, "interval": interval},
+                           timeout = TIMEOUT)
+    response.raise_for_status()
+    hist = pd.read_json(io.StringIO(response.text), orient = "split", dtype = False)
+    time_column = hist.columns[0]
+    hist[time_column] = pd.to_datetime(hist[time_column])
+    return hist.set_index(time_column)
+
+
+def recommend(symbol, name, random_score = 0.0, deltas = None):
+    '''
+    (stage, result, error) for every stage as the service streams it, as pipeline.run yields them
+    Pieces of the news answer go to the deltas queue, each followed by (None, None, None)
+    like pipeline.run's poll ticks, so the caller can show the answer as it grows
+    '''
+    with session.post(_url("/score"), json = {"symbol": symbol, "name": name, "random": random_score},
+                      stream = True, timeout = TIMEOUT) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if "delta" in event:
+                if deltas is not None:
+                    deltas.put(event["delta"])
+                yield None, None, None
+            elif "stage" in event:
+                result = event["result"]
+                if event["stage"] in ("news", "final") and result is not None:
+                    result = tuple(result)
+                yield event["stage"], result, ServiceError(event["error"]) if event["error"] is not None else None
+            else:
+                raise ServiceError(event["error"])
+
+
+def retrieve(_q, query, k = 5):
+    response = session.post(_url("/search"), json = {"company": _q, "query": query, "k": k}, timeout = TIMEOUT)
+    response.raise_for_status()
+    return response.json()["chunks"]
+
+
+def stream_response(_q, query):
+    '''
+    Yield the answer as the service streams it
+    '''
+    with session.post(_url("/chat"), json = {"company": _q, "query": query}, stream = True,
+                      timeout = TIMEOUT) as response:
+        response.raise_for_status()
+        response.encoding = "utf-8"
+        for text in response.iter_content(chunk_size = None, decode_unicode = True):
+            if text:
+                yield text
@@ -1,16 +1,137 @@
-import pandas as pd
 import os
-# get by 'Name' and 'Symbol'
-os.chdir('stock_recommendation/src')
-df_nasdaq = pd.read_csv('nasdaq_screener_1751610474960.csv')
-df_xams = pd.read_csv('Euronext_Equities_XAMS.csv',
-    delimiter=';',
-)
-df_xpar= pd.read_csv('Euronext_Equities_XPAR.csv',
-    delimiter=';',
-)
-df_xams['Symbol'] = df_xams['Symbol'].astype(str) + '.AS'
-df_xpar['Symbol'] = df_xpar['Symbol'].astype(str) + '.PA'
-
-df = pd.concat([df_nasdaq[['Symbol', 'Name']], df_xams[['Symbol', 'Name']], df_xpar[['Symbol', 'Name']]], ignore_index=True)
-df.to_csv('symbol.csv', index=False)
\ No newline at end of file
+import sys
+import glob
+import json
+import hashlib
+import pandas as pd
+
+# Symbol master: NASDAQ screener + Euronext XAMS/XPAR merged into one typed table.
+# Rebuild: python symbol_list.py [--force]
+# Only source files whose content changed since the last build are re-read.
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+MASTER_PATH = os.path.join(SRC_DIR, 'symbol.parquet')
+CSV_PATH = os.path.join(SRC_DIR, 'symbol.csv')  # Symbol, Name only, for older readers
+STATE_PATH = os.path.join(SRC_DIR, 'symbol_sources.json')
+
+COLUMNS = ['Symbol', 'Name', 'ISIN', 'Exchange', 'Currency', 'Sector', 'Industry', 'Country', 'Market Cap', 'Source']
+CATEGORIES = ['Exchange', 'Currency', 'Sector', 'Industry', 'Country', 'Source']
+
+
+def read_nasdaq(path):
+    df = pd.read_csv(path)
+    df = df.dropna(subset=['Symbol'])
+    return pd.DataFrame({
+        'Symbol': df['Symbol'].str.strip(),
+        'Name': df['Name'].str.strip(),
+        'ISIN': None,
+        'Exchange': 'NASDAQ',
+        'Currency': 'USD',
+        'Sector': df['Sector'],
+        'Industry': df['Industry'],
+        'Country': df['Country'],
+        'Market Cap': pd.to_numeric(df['Market Cap'], errors='coerce'),
+    })
+
+
+def read_euronext(path, suffix, exchange):
+    df = pd.read_csv(path, delimiter=';', encoding='utf-8-sig')
+    df = df.dropna(subset=['Symbol', 'ISIN'])  # Skips the export's title / date rows
+    return pd.DataFrame({
+        'Symbol': df['Symbol'].astype(str).str.strip() + suffix,
+        'Name': df['Name'].str.strip(),
+        'ISIN': df['ISIN'],
+        'Exchange': exchange,
+        'Currency': df['Currency'],
+        'Sector': None,
+        'Industry': None,
+        'Country': None,
+        'Market Cap': None,
+    })
+
+
+# File pattern -> reader
+SOURCES = {
+    'nasdaq_screener_*.csv': read_nasdaq,
+    'Euronext_Equities_XAMS*.csv': lambda path: read_euronext(path, '.AS', 'XAMS'),
+    'Euronext_Equities_XPAR*.csv': lambda path: read_euronext(path, '.PA', 'XPAR'),
+}
+
+
+def _key(df):
+    # A listing is its ISIN on one exchange, or its symbol when there is no ISIN
+    return df['ISIN'].astype('string').str.cat(df['Exchange'].astype('string'), sep='@').fillna(df['Symbol'].astype('string'))
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def merge(master, new, source):
+    '''
+    Upsert one source's snapshot: listings it no longer has are dropped,
+    new values win, columns it does not provide keep their old values
+    '''
+    new = new.assign(Source=source)
+    new['_key'] = _key(new)
+    if master is None or master.empty:
+        return new
+    master = master.assign(_key=_key(master))
+    master = master[(master['Source'] != source) | master['_key'].isin(new['_key'])]
+    merged = pd.concat([master.astype(object), new.astype(object)], ignore_index=True)
+    return merged.groupby('_key', sort=False, as_index=False).last()
+
+
+def load_symbols():
+    '''
+    The symbol master, typed; falls back to the CSV when it has not been built
+    '''
+    if os.path.exists(MASTER_PATH):
+        return pd.read_parquet(MASTER_PATH)
+    return pd.read_csv(CSV_PATH)
+
+
+def build(force=False):
+    state = {}
+    if os.path.exists(STATE_PATH) and not force:
+        with open(STATE_PATH, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    master = pd.read_parquet(MASTER_PATH) if os.path.exists(MASTER_PATH) and not force else None
+
+    changed = False
+    for pattern, reader in SOURCES.items():
+        # Newest export of each source, e.g. the latest nasdaq_screener_<timestamp>.csv
+        paths = sorted(glob.glob(os.path.join(SRC_DIR, pattern)), key=os.path.getmtime)
+        if not paths:
+            continue
+        path = paths[-1]
+        digest = _file_hash(path)
+        if state.get(pattern) == digest:
+            continue
+        print(f"Merging {os.path.basename(path)}")
+        master = merge(master, reader(path), pattern)
+        state[pattern] = digest
+        changed = True
+
+    if not changed:
+        print("Symbol master is up to date")
+        return master
+
+    master = master[COLUMNS].reset_index(drop=True)
+    master['Market Cap'] = pd.to_numeric(master['Market Cap'], errors='coerce')
+    for col in ['Symbol', 'Name', 'ISIN']:
+        master[col] = master[col].astype('string')
+    for col in CATEGORIES:
+        master[col] = master[col].astype('category')
+
+    master.to_parquet(MASTER_PATH + '.tmp', index=False)
+    os.replace(MASTER_PATH + '.tmp', MASTER_PATH)
+    master[['Symbol', 'Name']].to_csv(CSV_PATH, index=False)
+    with open(STATE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    print(f"Wrote {len(master)} listings to {MASTER_PATH}")
+    return master
+
+
+if __name__ == '__main__':
+    build(force='--force' in sys.argv)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import dedup
+
+
+def _pair(jaccard, n, seed):
+    '''
+    Two n-word texts sharing a leading run of words, sized so their shingle sets
+    have about the given Jaccard similarity
+    '''
+    common = int(round(2 * jaccard * n / (1 + jaccard)))
+    shared = [f"s{seed}x{i}" for i in range(common)]
+    a = shared + [f"a{seed}x{i}" for i in range(n - common)]
+    b = shared + [f"b{seed}x{i}" for i in range(n - common)]
+    return " ".join(a), " ".join(b)
+
+
+def _exact(a, b):
+    a, b = dedup.shingles(a), dedup.shingles(b)
+    return len(a & b) / len(a | b)
+
+
+@pytest.mark.parametrize("jaccard", [0.3, 0.8])
+def test_minhash_estimates_jaccard(jaccard):
+    errors = []
+    for seed in range(100):
+        a, b = _pair(jaccard, 600, seed)
+        errors.append(dedup.similarity(dedup.minhash(a), dedup.minhash(b)) - _exact(a, b))
+    errors = np.array(errors)
+    # Independent permutations: std ~ sqrt(J (1 - J) / NUM_PERM), 0.04 at J = 0.3
+    expected = np.sqrt(jaccard * (1 - jaccard) / dedup.NUM_PERM)
+    assert abs(errors.mean()) < 0.02
+    assert errors.std() < 1.5 * expected
+
+
+def test_dissimilar_articles_are_not_duplicates():
+    for seed in range(100):
+        a, b = _pair(0.33, 600, seed)
+        assert dedup.similarity(dedup.minhash(a), dedup.minhash(b)) < dedup.THRESHOLD
+
+
+def test_canonical_url_malformed_port():
+    assert dedup.canonical_url("http://x.com:abc/a/") == "https://x.com:abc/a"
+    assert dedup.canonical_url("http://www.x.com:80/a/?utm_source=feed") == "https://x.com/a"
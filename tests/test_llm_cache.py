@@ -0,0 +1,44 @@
+import time
+import itertools
+import sqlite3
+import pytest
+
+llmAPI = pytest.importorskip("llmAPI")  # Needs groq and the encoder's dependencies
+
+
+def _age(path, key, seconds):
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE responses SET created_at = ? WHERE key = ?", (time.time() - seconds, key))
+    conn.commit()
+    conn.close()
+
+
+def _keys(path):
+    conn = sqlite3.connect(path)
+    keys = {row[0] for row in conn.execute("SELECT key FROM responses")}
+    conn.close()
+    return keys
+
+
+def test_cache_evict_deletes_expired_rows(tmp_path):
+    path = str(tmp_path / "llm.db")
+    llmAPI.cache_put("old", "stale answer", 0.1, path = path)
+    llmAPI.cache_put("new", "fresh answer", 0.2, path = path)
+    _age(path, "old", llmAPI.CACHE_TTL + 60)
+
+    assert llmAPI.cache_evict(path = path) == 1
+    assert _keys(path) == {"new"}
+    assert llmAPI.cache_get("new", path = path) == ("fresh answer", 0.2)
+
+
+def test_cache_put_evicts_periodically(tmp_path, monkeypatch):
+    path = str(tmp_path / "llm.db")
+    monkeypatch.setattr(llmAPI, "EVICT_EVERY", 3)
+    monkeypatch.setattr(llmAPI, "_puts", itertools.count(1))
+    llmAPI.cache_put("old", "stale answer", None, path = path)
+    _age(path, "old", llmAPI.CACHE_TTL + 60)
+
+    llmAPI.cache_put("a", "answer", None, path = path)
+    assert "old" in _keys(path)
+    llmAPI.cache_put("b", "answer", None, path = path)  # Third put: expired rows are pruned
+    assert _keys(path) == {"a", "b"}
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import threading
+import contextvars
+
+# Lightweight spans around the hot path: yfinance fetches, article download / parse,
+# chunking, encoding, FAISS search, LLM calls and scoring.
+# Off unless STOCKREC_TRACE is set (or enable() is called); when off, span() returns
+# one shared no-op object, so an instrumented call costs a function call and a flag check.
+# Spans opened inside `with trace(...)` are collected on that trace, also from pool
+# threads started through bind(). STOCKREC_TRACE_PATH appends every finished trace as
+# one JSON line.
+ENABLED = os.getenv("STOCKREC_TRACE", "").lower() not in ("", "0", "false", "no")
+EXPORT_PATH = os.getenv("STOCKREC_TRACE_PATH")
+SERVICE_NAME = "stock_recommendation"
+
+_EPOCH_NS = time.time_ns() - time.perf_counter_ns()  # Wall clock of perf_counter 0
+_collector = contextvars.ContextVar("trace_spans", default = None)
+_parent = contextvars.ContextVar("trace_parent", default = None)
+_export_lock = threading.Lock()
+
+
+def enable(on = True):
+    global ENABLED
+    ENABLED = on
+
+
+def _new_id(nbytes):
+    return os.urandom(nbytes).hex()
+
+
+class Span:
+    '''
+    One timed operation; attributes by convention: bytes, cache ("hit" / "miss"), n
+    '''
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attrs", "error", "_token")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.error = None
+        parent = _parent.get()
+        self.trace_id = parent.trace_id if parent is not None else _new_id(16)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.span_id = _new_id(8)
+        self.start_ns = self.end_ns = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self):
+        self._token = _parent.set(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.perf_counter_ns()
+        _parent.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        spans = _collector.get()
+        if spans is not None:
+            spans.append(self)  # list.append is atomic, pool threads share the list
+        return False
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": (_EPOCH_NS + self.start_ns) / 1e9,
+            "duration_ms": round(self.duration_ms, 3),
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP = _NoopSpan()
+
+
+def span(name, **attrs):
+    '''
+    with span("news.download", url = url) as s: ...; s.set(bytes = n)
+    '''
+    if not ENABLED:
+        return NOOP
+    return Span(name, attrs)
+
+
+def record(name, duration_s, **attrs):
+    '''
+    Add a finished span measured elsewhere, e.g. in a process pool worker
+    '''
+    if not ENABLED:
+        return
+    s = Span(name, attrs)
+    s.end_ns = time.perf_counter_ns()
+    s.start_ns = s.end_ns - int(duration_s * 1e9)
+    spans = _collector.get()
+    if spans is not None:
+        spans.append(s)
+
+
+def bind(fn):
+    '''
+    fn running in the caller's trace context, for ThreadPoolExecutor.submit / map
+    Every call gets its own copy, so concurrent calls do not share one Context
+    '''
+    if not ENABLED:
+        return fn
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)
+
+
+class trace:
+    '''
+    Collect every span of one request:
+        with trace("recommendation", symbol = "AAPL") as t: ...
+        t.summary(), t.to_json(), t.to_otel()
+    '''
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self._root = None
+
+    def __enter__(self):
+        if ENABLED:
+            self._token = _collector.set(self.spans)
+            self._root = Span(self.name, self.attrs).__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._root is not None:
+            self._root.__exit__(exc_type, exc, tb)
+            _collector.reset(self._token)
+            if EXPORT_PATH:
+                self.export(EXPORT_PATH)
+        return False
+
+    def to_json(self):
+        return [s.to_dict() for s in sorted(self.spans, key = lambda s: s.start_ns)]
+
+    def to_otel(self):
+        '''
+        OTLP/JSON-shaped resourceSpans, accepted by OpenTelemetry collectors
+        '''
+        def value(v):
+            if isinstance(v, bool):
+                return {"boolValue": v}
+            if isinstance(v, int):
+                return {"intValue": str(v)}
+            if isinstance(v, float):
+                return {"doubleValue": v}
+            return {"stringValue": str(v)}
+
+        spans = []
+        for s in sorted(self.spans, key = lambda s: s.start_ns):
+            spans.append({
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(_EPOCH_NS + s.start_ns),
+                "endTimeUnixNano": str(_EPOCH_NS + s.end_ns),
+                "attributes": [{"key": k, "value": value(v)} for k, v in s.attrs.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            })
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]}
+
+    def summary(self):
+        '''
+        Per span name: count, total / max ms, bytes, cache hits and misses, errors
+        Sorted by total time, the root span first
+        '''
+        rows = {}
+        for s in self.spans:
+            row = rows.setdefault(s.name, {"span": s.name, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                           "bytes": 0, "hits": 0, "misses": 0, "errors": 0})
+            row["count"] += 1
+            row["total_ms"] += s.duration_ms
+            row["max_ms"] = max(row["max_ms"], s.duration_ms)
+            row["bytes"] += int(s.attrs.get("bytes", 0) or 0)
+            row["hits"] += s.attrs.get("cache") == "hit"
+            row["misses"] += s.attrs.get("cache") == "miss"
+            row["errors"] += s.error is not None
+        return sorted(rows.values(), key = lambda r: (r["span"] != self.name, -r["total_ms"]))
+
+    def export(self, path):
+        line = json.dumps({"trace": self.name, "spans": self.to_json()}, default = str)
+        with _export_lock, open(path, "a", encoding = "utf-8") as f:
+            f.write(line + "\n")